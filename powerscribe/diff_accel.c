@@ -0,0 +1,175 @@
+/*
+ReportDiff compiled diff backend
+
+C version of diff_match_patch.diff_bisect's search for the 'middle snake',
+loaded by diff_engine.py through ctypes when it has been built:
+
+    gcc -O2 -shared -fPIC -o _diff_accel.so diff_accel.c         (Linux, macOS)
+    gcc -O2 -shared -o _diff_accel.dll diff_accel.c              (Windows, MinGW)
+
+Without the library diff_engine uses the pure Python bisect, which gives
+the same diffs.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+*/
+
+#include <stdint.h>
+#include <stdlib.h>
+
+#ifdef _WIN32
+#include <windows.h>
+#define EXPORT __declspec(dllexport)
+#else
+#include <sys/time.h>
+#define EXPORT
+#endif
+
+/* Seconds since the epoch, the same clock as Python's time.time() */
+static double now(void)
+{
+#ifdef _WIN32
+    FILETIME ft;
+    ULARGE_INTEGER t;
+    GetSystemTimeAsFileTime(&ft);
+    t.LowPart=ft.dwLowDateTime;
+    t.HighPart=ft.dwHighDateTime;
+    return (double)(t.QuadPart-116444736000000000ULL)/1e7;
+#else
+    struct timeval tv;
+    gettimeofday(&tv,NULL);
+    return tv.tv_sec+tv.tv_usec/1e6;
+#endif
+}
+
+/*
+Find the 'middle snake' of a diff of two UTF-32 texts, walking the same
+paths in the same order as diff_match_patch.diff_bisect.
+
+Returns 1 and sets *x and *y to the split point if the paths overlap, 0 if
+the deadline was reached or the texts have nothing in common, and -1 if
+the V vectors could not be allocated.
+*/
+EXPORT int diff_bisect(const uint32_t *text1,int text1_length,
+                       const uint32_t *text2,int text2_length,
+                       double deadline,int *x,int *y)
+{
+    int max_d=(text1_length+text2_length+1)/2;
+    int v_offset=max_d;
+    int v_length=2*max_d;
+    int delta=text1_length-text2_length;
+    /* If the total number of characters is odd, then the front path will
+       collide with the reverse path. */
+    int front=(delta%2!=0);
+    /* Offsets for start and end of k loop.
+       Prevents mapping of space beyond the grid. */
+    int k1start=0,k1end=0,k2start=0,k2end=0;
+    int d,k1,k2,k1_offset,k2_offset,x1,y1,x2,y2,i;
+    int found=0;
+    int *v1=malloc(2*(size_t)(v_length+2)*sizeof(int));
+    int *v2;
+
+    if (v1==NULL)
+        return -1;
+    v2=v1+v_length+2;
+    for (i=0;i<v_length+2;i++) {
+        v1[i]=-1;
+        v2[i]=-1;
+    }
+    v1[v_offset+1]=0;
+    v2[v_offset+1]=0;
+
+    for (d=0;d<max_d && !found;d++) {
+        /* Bail out if deadline is reached. */
+        if (now()>deadline)
+            break;
+
+        /* Walk the front path one step. */
+        for (k1=-d+k1start;k1<d+1-k1end;k1+=2) {
+            k1_offset=v_offset+k1;
+            if (k1==-d || (k1!=d && v1[k1_offset-1]<v1[k1_offset+1]))
+                x1=v1[k1_offset+1];
+            else
+                x1=v1[k1_offset-1]+1;
+            y1=x1-k1;
+            while (x1<text1_length && y1<text2_length && text1[x1]==text2[y1]) {
+                x1++;
+                y1++;
+            }
+            v1[k1_offset]=x1;
+            if (x1>text1_length) {
+                /* Ran off the right of the graph. */
+                k1end+=2;
+            } else if (y1>text2_length) {
+                /* Ran off the bottom of the graph. */
+                k1start+=2;
+            } else if (front) {
+                k2_offset=v_offset+delta-k1;
+                if (k2_offset>=0 && k2_offset<v_length && v2[k2_offset]!=-1) {
+                    /* Mirror x2 onto top-left coordinate system. */
+                    x2=text1_length-v2[k2_offset];
+                    if (x1>=x2) {
+                        /* Overlap detected. */
+                        *x=x1;
+                        *y=y1;
+                        found=1;
+                        break;
+                    }
+                }
+            }
+        }
+        if (found)
+            break;
+
+        /* Walk the reverse path one step. */
+        for (k2=-d+k2start;k2<d+1-k2end;k2+=2) {
+            k2_offset=v_offset+k2;
+            if (k2==-d || (k2!=d && v2[k2_offset-1]<v2[k2_offset+1]))
+                x2=v2[k2_offset+1];
+            else
+                x2=v2[k2_offset-1]+1;
+            y2=x2-k2;
+            while (x2<text1_length && y2<text2_length &&
+                   text1[text1_length-x2-1]==text2[text2_length-y2-1]) {
+                x2++;
+                y2++;
+            }
+            v2[k2_offset]=x2;
+            if (x2>text1_length) {
+                /* Ran off the left of the graph. */
+                k2end+=2;
+            } else if (y2>text2_length) {
+                /* Ran off the top of the graph. */
+                k2start+=2;
+            } else if (!front) {
+                k1_offset=v_offset+delta-k2;
+                if (k1_offset>=0 && k1_offset<v_length && v1[k1_offset]!=-1) {
+                    x1=v1[k1_offset];
+                    y1=v_offset+x1-k1_offset;
+                    /* Mirror x2 onto top-left coordinate system. */
+                    x2=text1_length-x2;
+                    if (x1>=x2) {
+                        /* Overlap detected. */
+                        *x=x1;
+                        *y=y1;
+                        found=1;
+                        break;
+                    }
+                }
+            }
+        }
+    }
+    free(v1);
+    return found;
+}
@@ -0,0 +1,170 @@
+"""ReportDiff diff engine benchmark
+
+Compares the diff engine's optimized paths with the reference
+diff_match_patch path on report pairs from a ReportDiff database: each
+optimized result must match the reference exactly, and both are timed.
+
+    python diff_benchmark.py reportdiff_ps.db [number of pairs]
+
+Without a database, "fuzz" runs the same checks on randomly generated and
+edited report-like pairs instead, including non-ASCII characters, empty
+reports and identical pairs:
+
+    python diff_benchmark.py fuzz [number of pairs] [seed]
+
+Peak memory is also reported for database pairs where tracemalloc is
+available (Python 3); tracing the much longer diffs of the heavily edited
+synthetic pairs would take far longer than the checks.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import sys,time,random
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc=None
+from sqlite_db import execute_sql
+import report_store
+from report_store import normalize_report
+import diff_engine
+
+def load_pairs(dbfile,limit):
+    """Return up to limit normalized (prelim, final) pairs of scored studies"""
+    rows=execute_sql(dbfile,"select "+report_store.report_columns+""" from study
+                        where diff_score is not null order by random() limit ?""",(limit,))
+    pairs=[]
+    for row in rows or []:
+        prelim=report_store.decode_report(dbfile,row["prelim"])
+        final=report_store.decode_report(dbfile,row["final"])
+        if prelim is not None and final is not None:
+            pairs.append((normalize_report(prelim),normalize_report(final)))
+    return pairs
+
+# Words the synthetic reports are made of, with some non-ASCII characters
+fuzz_words=[u'the',u'liver',u'is',u'normal',u'in',u'size',u'no',u'focal',u'lesion',u'kidneys',u'unremarkable',
+            u'impression:',u'findings:',u'mild',u'fatty',u'infiltration',u'3.2',u'cm',u'\u00b0',u'caf\u00e9',
+            u'\u2264',u'\u00b1',u'.',u',',u'\n']
+
+def fuzz_pairs(count,seed=0):
+    """Return count random (prelim, final) pairs of report-like text
+    
+    Each final is its prelim with random word and character insertions,
+    deletions and replacements, from none up to a rewrite of much of the
+    text.
+    """
+    rng=random.Random(seed)
+    pairs=[]
+    for i in range(count):
+        prelim=u' '.join(rng.choice(fuzz_words) for j in range(rng.randint(0,rng.choice([0,3,30,200,200]))))
+        final=prelim
+        for j in range(rng.choice([0,1,5,20,50])):
+            start=rng.randint(0,len(final))
+            end=min(len(final),start+rng.choice([0,1,3,20,100]))
+            insert=rng.choice([u'',rng.choice(fuzz_words),u' '.join(rng.choice(fuzz_words) for k in range(rng.randint(1,30)))])
+            final=final[:start]+insert+final[end:]
+        pairs.append((prelim,final))
+    return pairs
+
+def timed(function,items):
+    start=time.time()
+    results=[function(item) for item in items]
+    return (results,time.time()-start)
+
+def traced(function,items):
+    """Return the peak memory allocated while applying function to items"""
+    tracemalloc.start()
+    for item in items:
+        function(item)
+    peak=tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def check_bisect(pairs,array_bisect=False,compiled=False):
+    """diff_engine's reused bisect buffers against diff_match_patch's bisect"""
+    reference_dmp=diff_engine.diff_match_patch.diff_match_patch()
+    reference_dmp.Diff_Timeout=0
+    dmp=diff_engine.diff_engine()
+    dmp.Diff_Timeout=0
+    dmp.Diff_ArrayBisect=array_bisect
+    dmp.Diff_Compiled=compiled
+    
+    def reference(item):
+        return reference_dmp.diff_main(item[0],item[1],False)
+    
+    def optimized(item):
+        return dmp.diff_main(item[0],item[1],False)
+    
+    return (reference,optimized,pairs)
+
+def check_array_bisect(pairs):
+    """diff_engine's reused array('i') bisect buffers against diff_match_patch's bisect"""
+    return check_bisect(pairs,array_bisect=True)
+
+def check_compiled_bisect(pairs):
+    """The compiled bisect (diff_accel.c) against diff_match_patch's bisect"""
+    return check_bisect(pairs,compiled=True)
+
+def check_banded_distance(pairs):
+    """diff_editDistance's banded search, bounded by 10% of the final, against its bit vectors"""
+    dmp=diff_engine.diff_engine()
+    
+    def reference(item):
+        return dmp.diff_editDistance(item[0],item[1])
+    
+    def optimized(item):
+        return dmp.diff_editDistance(item[0],item[1],len(item[1])//10+1)
+    
+    return (reference,optimized,pairs)
+
+# Each check returns the reference function, the optimized function and the
+# items to apply them to
+checks=[("list bisect",check_bisect),
+        ("array bisect",check_array_bisect),
+        ("banded distance",check_banded_distance)]
+if diff_engine.get_accel() is not None:
+    checks.append(("compiled bisect",check_compiled_bisect))
+
+if __name__=='__main__':
+    dbfile=sys.argv[1] if len(sys.argv)>1 else 'reportdiff_ps.db'
+    fuzz=(dbfile=="fuzz")
+    limit=int(sys.argv[2]) if len(sys.argv)>2 else 200 if fuzz else 1000
+    if fuzz:
+        pairs=fuzz_pairs(limit,int(sys.argv[3]) if len(sys.argv)>3 else 0)
+        print("{0} synthetic report pairs".format(len(pairs)))
+    else:
+        pairs=load_pairs(dbfile,limit)
+        print("{0} report pairs".format(len(pairs)))
+    trace=tracemalloc is not None and not fuzz
+    if diff_engine.get_accel() is None:
+        print("The compiled bisect is not built, so it is not checked")
+    header="{0:<16} {1:>10} {2:>12} {3:>12} {4:>8}".format("check","mismatches","reference s","optimized s","speedup")
+    if trace:
+        header+=" {0:>13} {1:>13}".format("reference KB","optimized KB")
+    print(header)
+    failed=False
+    for (name,check) in checks:
+        (reference,optimized,items)=check(pairs)
+        (expected,reference_time)=timed(reference,items)
+        (results,optimized_time)=timed(optimized,items)
+        mismatches=sum(1 for (a,b) in zip(expected,results) if a!=b)
+        failed=failed or mismatches>0
+        line="{0:<16} {1:>10} {2:>12.3f} {3:>12.3f} {4:>8.2f}".format(name,mismatches,reference_time,optimized_time,
+                                                                  reference_time/max(optimized_time,1e-9))
+        if trace:
+            line+=" {0:>13.0f} {1:>13.0f}".format(traced(reference,items)/1024.0,traced(optimized,items)/1024.0)
+        print(line)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,95 @@
+"""ReportDiff diff cache
+
+Edit scores and diff deltas of scored report pairs, keyed by a hash of the
+normalized prelim and final text, the diff engine version and the scoring
+settings.  A pair that was scored before with the same settings, such as a
+template-only normal report or a study whose score was reset for rescoring,
+is looked up instead of diffed again.  Changing the normalization, the
+settings or diff_engine.engine_version changes the keys, so stale entries
+are never used.  Only exact scores (diff_exact=1) are cached: an approximate
+diff depends on how busy the machine was, so the pair is diffed again the
+next time it is scored.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+from sqlite_db import connect,execute_sql
+import diff_engine
+
+# Score columns stored for each pair, in the order of the cached score tuples
+score_columns=("diff_score","diff_score_percent","word_diff_score","word_diff_score_percent","diff_exact",
+               "edit_distance","edit_distance_percent")
+
+def create_cache_table(dbfile):
+    conn=connect(dbfile)
+    conn.execute("""create table if not exists diff_cache(
+                    key text,
+                    diff_score int,
+                    diff_score_percent real,
+                    word_diff_score int,
+                    word_diff_score_percent real,
+                    diff_exact int,
+                    edit_distance int,
+                    edit_distance_percent real,
+                    delta text,
+                    section_scores text,
+                    primary key(key) );""")
+    conn.commit()
+
+def cache_key(prelim,final,settings):
+    """Return the cache key of a normalized report pair
+    
+    Args:
+        prelim: normalized prelim text
+        final: normalized final text
+        settings: tuple of the settings that affect the scores
+    """
+    h=hashlib.sha1()
+    h.update(repr((diff_engine.engine_version,settings)).encode('utf-8'))
+    for text in (prelim,final):
+        data=text.encode('utf-8')
+        h.update(str(len(data)).encode('ascii')+b':')
+        h.update(data)
+    return h.hexdigest()
+
+def get_cached(dbfile,keys):
+    """Look up cached pairs
+    
+    Returns:
+        dict of key to (scores, delta, section scores), where scores is a tuple in
+        the order of score_columns and section scores a list of (section,
+        diff_score, diff_score_percent) tuples
+    """
+    cached={}
+    keys=list(keys)
+    for i in range(0,len(keys),500):
+        batch=keys[i:i+500]
+        rows=execute_sql(dbfile,"select key, "+", ".join(score_columns)+", delta, section_scores from diff_cache where key in ("+
+                         ",".join("?"*len(batch))+")",batch)
+        for row in rows or []:
+            section_scores=[tuple(section) for section in json.loads(row["section_scores"])]
+            cached[row["key"]]=(tuple(row[column] for column in score_columns),row["delta"],section_scores)
+    return cached
+
+def put_cached(writer,key,scores,delta,section_scores):
+    """Queue a cache entry write on a sqlite_db.batch_writer
+    
+    Callers only cache exact scores.
+    """
+    writer.add("replace into diff_cache (key, "+", ".join(score_columns)+", delta, section_scores) values ("+
+               ",".join("?"*(len(score_columns)+3))+")",
+               (key,)+tuple(scores)+(delta,json.dumps(section_scores)))
@@ -0,0 +1,661 @@
+"""ReportDiff diff engine
+
+Extends Google's diff_match_patch with the diff modes used to score reports.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import ctypes
+import os
+import re
+import sys
+import time
+from array import array
+
+import diff_match_patch
+
+PY3=sys.version_info > (3,)
+# Bound here on both versions, since report_sections uses diff_engine.unichr
+try:
+    unichr=unichr
+except NameError:
+    unichr=chr
+
+# A word token is a run of word characters or a single other character, with
+# any whitespace that follows it.  Concatenated tokens split back into the
+# same tokens, so any run of whole tokens can be re-tokenized.
+word_re=re.compile(r'\s+|\w+\s*|[^\w\s]\s*',re.UNICODE)
+
+# Version of the diffs and scores the engine produces.  Increment it when a
+# change alters them, so that cached diffs (diff_cache.py) are recomputed.
+engine_version=1
+
+# Use the compiled bisect (diff_accel.c) when it has been built next to this
+# module.  It gives the same diffs as the Python bisect.
+use_compiled=True
+accel_libraries=('_diff_accel.so','_diff_accel.dll')
+accel=None
+accel_loaded=False
+
+def get_accel():
+    """Load the compiled diff backend, or return None if it is not available"""
+    global accel,accel_loaded
+    if not accel_loaded:
+        accel_loaded=True
+        directory=os.path.dirname(os.path.abspath(__file__))
+        for name in accel_libraries:
+            path=os.path.join(directory,name)
+            if not os.path.exists(path):
+                continue
+            try:
+                library=ctypes.CDLL(path)
+            except OSError as e:
+                print("Cannot load {0}: {1}".format(path,e))
+                continue
+            library.diff_bisect.argtypes=[ctypes.c_char_p,ctypes.c_int,ctypes.c_char_p,ctypes.c_int,
+                                          ctypes.c_double,ctypes.POINTER(ctypes.c_int),ctypes.POINTER(ctypes.c_int)]
+            library.diff_bisect.restype=ctypes.c_int
+            accel=library
+            break
+    return accel
+
+def utf32(text):
+    """Encode a text as one 32-bit code unit per character, or return None
+    if the text's characters are not single code points"""
+    try:
+        if PY3:
+            data=text.encode('utf-32-le','surrogatepass')
+        else:
+            data=text.encode('utf-32-le')
+    except (UnicodeError,AttributeError):
+        return None
+    if len(data)!=4*len(text):
+        return None
+    return data
+
+class diff_engine(diff_match_patch.diff_match_patch):
+    """diff_match_patch with word-level and time-bounded diffs for report scoring"""
+
+    def __init__(self):
+        diff_match_patch.diff_match_patch.__init__(self)
+        # Set when a bisect ran past its deadline and returned a non-minimal diff
+        self.Diff_TimedOut=False
+        # The bisect V vectors are kept in buffers that are reused by every
+        # bisect instead of allocated for each one.  Array buffers
+        # (array('i')) take an eighth of the memory of lists, but are about
+        # a quarter slower to index in CPython; see diff_benchmark.py.
+        self.Diff_ArrayBisect=False
+        # Use the compiled bisect when it is available
+        self.Diff_Compiled=use_compiled and get_accel() is not None
+        # diff_editDistance's banded search is used while the square of the
+        # band is at most this many times the text length
+        self.Diff_BandLimit=2
+        self.bisect_v1=[]
+        self.bisect_v2=[]
+
+    def diff_bisect(self,text1,text2,deadline):
+        """Find the 'middle snake' of a diff, split the problem in two
+        and return the recursively constructed diff, recording whether the
+        deadline was hit.
+
+        Unlike diff_match_patch.diff_bisect, the V vectors are the engine's
+        bisect buffers.  A bisect is done with them before it recurses through
+        diff_bisectSplit, so every bisect of a diff can share them.  They grow
+        to the largest bisect seen.  Instead of resetting them to -1 up front,
+        each step d resets the entries it can reach for the first time, so a
+        bisect allocates nothing and only touches the part of the buffers it
+        searches.
+
+        Args:
+            text1: Old string to be diffed.
+            text2: New string to be diffed.
+            deadline: Time at which to bail if not yet complete.
+
+        Returns:
+            Array of diff tuples.
+        """
+        if self.Diff_Compiled:
+            diffs=self.diff_bisectCompiled(text1,text2,deadline)
+            if diffs is not None:
+                return diffs
+        text1_length=len(text1)
+        text2_length=len(text2)
+        max_d=(text1_length+text2_length+1)//2
+        v_offset=max_d
+        v_length=2*max_d
+        if len(self.bisect_v1)<v_length or isinstance(self.bisect_v1,array)!=self.Diff_ArrayBisect:
+            if self.Diff_ArrayBisect:
+                self.bisect_v1=array('i',[-1])*v_length
+                self.bisect_v2=array('i',[-1])*v_length
+            else:
+                self.bisect_v1=[-1]*v_length
+                self.bisect_v2=[-1]*v_length
+        v1=self.bisect_v1
+        v2=self.bisect_v2
+        delta=text1_length-text2_length
+        # Step d reads entries up to d from v_offset on its own path, and up
+        # to d+|delta| on the other path when checking for overlap.  Entries
+        # within cleared of v_offset have been reset for this bisect.
+        abs_delta=abs(delta)
+        cleared=max(abs_delta,1)
+        for i in range(max(0,v_offset-cleared),min(v_length,v_offset+cleared+1)):
+            v1[i]=-1
+            v2[i]=-1
+        v1[v_offset+1]=0
+        v2[v_offset+1]=0
+        # If the total number of characters is odd, then the front path will
+        # collide with the reverse path.
+        front=(delta%2!=0)
+        # Offsets for start and end of k loop.
+        # Prevents mapping of space beyond the grid.
+        k1start=0
+        k1end=0
+        k2start=0
+        k2end=0
+        for d in range(max_d):
+            # Bail out if deadline is reached.
+            if time.time()>deadline:
+                break
+            if d+abs_delta>cleared:
+                cleared=d+abs_delta
+                if v_offset-cleared>=0:
+                    v1[v_offset-cleared]=-1
+                    v2[v_offset-cleared]=-1
+                if v_offset+cleared<v_length:
+                    v1[v_offset+cleared]=-1
+                    v2[v_offset+cleared]=-1
+
+            # Walk the front path one step.
+            for k1 in range(-d+k1start,d+1-k1end,2):
+                k1_offset=v_offset+k1
+                if k1==-d or (k1!=d and v1[k1_offset-1]<v1[k1_offset+1]):
+                    x1=v1[k1_offset+1]
+                else:
+                    x1=v1[k1_offset-1]+1
+                y1=x1-k1
+                while x1<text1_length and y1<text2_length and text1[x1]==text2[y1]:
+                    x1+=1
+                    y1+=1
+                v1[k1_offset]=x1
+                if x1>text1_length:
+                    # Ran off the right of the graph.
+                    k1end+=2
+                elif y1>text2_length:
+                    # Ran off the bottom of the graph.
+                    k1start+=2
+                elif front:
+                    k2_offset=v_offset+delta-k1
+                    if k2_offset>=0 and k2_offset<v_length and v2[k2_offset]!=-1:
+                        # Mirror x2 onto top-left coordinate system.
+                        x2=text1_length-v2[k2_offset]
+                        if x1>=x2:
+                            # Overlap detected.
+                            return self.diff_bisectSplit(text1,text2,x1,y1,deadline)
+
+            # Walk the reverse path one step.
+            for k2 in range(-d+k2start,d+1-k2end,2):
+                k2_offset=v_offset+k2
+                if k2==-d or (k2!=d and v2[k2_offset-1]<v2[k2_offset+1]):
+                    x2=v2[k2_offset+1]
+                else:
+                    x2=v2[k2_offset-1]+1
+                y2=x2-k2
+                while x2<text1_length and y2<text2_length and text1[-x2-1]==text2[-y2-1]:
+                    x2+=1
+                    y2+=1
+                v2[k2_offset]=x2
+                if x2>text1_length:
+                    # Ran off the left of the graph.
+                    k2end+=2
+                elif y2>text2_length:
+                    # Ran off the top of the graph.
+                    k2start+=2
+                elif not front:
+                    k1_offset=v_offset+delta-k2
+                    if k1_offset>=0 and k1_offset<v_length and v1[k1_offset]!=-1:
+                        x1=v1[k1_offset]
+                        y1=v_offset+x1-k1_offset
+                        # Mirror x2 onto top-left coordinate system.
+                        x2=text1_length-x2
+                        if x1>=x2:
+                            # Overlap detected.
+                            return self.diff_bisectSplit(text1,text2,x1,y1,deadline)
+
+        # Diff took too long and hit the deadline or
+        # number of diffs equals number of characters, no commonality at all.
+        if time.time()>deadline:
+            self.Diff_TimedOut=True
+        return [(self.DIFF_DELETE,text1),(self.DIFF_INSERT,text2)]
+
+    def diff_bisectCompiled(self,text1,text2,deadline):
+        """diff_bisect with the middle snake found by the compiled backend.
+
+        Args:
+            text1: Old string to be diffed.
+            text2: New string to be diffed.
+            deadline: Time at which to bail if not yet complete.
+
+        Returns:
+            Array of diff tuples, or None if the texts cannot be passed to
+            the compiled backend.
+        """
+        data1=utf32(text1)
+        data2=utf32(text2)
+        if data1 is None or data2 is None:
+            return None
+        x=ctypes.c_int()
+        y=ctypes.c_int()
+        found=accel.diff_bisect(data1,len(text1),data2,len(text2),float(deadline),ctypes.byref(x),ctypes.byref(y))
+        if found<0:
+            raise MemoryError("Cannot allocate bisect buffers")
+        if found:
+            return self.diff_bisectSplit(text1,text2,x.value,y.value,deadline)
+        if time.time()>deadline:
+            self.Diff_TimedOut=True
+        return [(self.DIFF_DELETE,text1),(self.DIFF_INSERT,text2)]
+
+    def diff_bounded(self,text1,text2,deadline=None,fallback_deadline=None,words=False):
+        """Diff two texts by a deadline, falling back to faster heuristics
+        when the exact diff does not finish in time.
+
+        The exact diff is the one diff_main computes with Diff_Timeout=0.  If it
+        is not complete by deadline, or deadline has already passed, the texts
+        are diffed with the half-match speedup and word tokens until
+        fallback_deadline instead, which is much faster but may not be minimal.
+        Several diffs can share the same two deadlines, so that together they
+        finish by fallback_deadline.
+
+        Args:
+            text1: Old string to be diffed.
+            text2: New string to be diffed.
+            deadline: Time the exact diff must be complete by (None for no limit).
+            fallback_deadline: Time the fallback diff must be complete by
+                (None for no limit).
+            words: Diff word tokens (diff_wordMode) instead of characters.
+
+        Returns:
+            Two element tuple of the array of changes and whether the diff is exact.
+        """
+        if deadline is None:
+            deadline=sys.maxsize
+        if fallback_deadline is None:
+            fallback_deadline=sys.maxsize
+        timeout=self.Diff_Timeout
+        try:
+            self.Diff_Timeout=0
+            self.Diff_TimedOut=time.time()>deadline
+            if not self.Diff_TimedOut:
+                if words:
+                    diffs=self.diff_wordMode(text1,text2,deadline)
+                else:
+                    diffs=self.diff_main(text1,text2,True,deadline)
+                if not self.Diff_TimedOut:
+                    return (diffs,True)
+
+            # Any positive timeout enables the half-match speedup
+            self.Diff_Timeout=1
+            diffs=self.diff_wordMode(text1,text2,fallback_deadline)
+            return (diffs,False)
+        finally:
+            self.Diff_Timeout=timeout
+
+    def diff_sections(self,pieces,deadline=None):
+        """Diff two texts piece by piece, such as the aligned sections of two
+        reports (report_sections.align_sections).
+
+        Diffing several small pieces is much faster than diffing the whole
+        texts, but edits cannot match text across piece boundaries.
+
+        Args:
+            pieces: Array of (text1, text2) tuples that concatenate to the
+                texts to be diffed.
+            deadline: Optional time when the diff should be complete by.
+
+        Returns:
+            Array of changes between the concatenated texts.
+        """
+        if deadline is None:
+            if self.Diff_Timeout<=0:
+                deadline=sys.maxsize
+            else:
+                deadline=time.time()+self.Diff_Timeout
+        diffs=[]
+        for (text1,text2) in pieces:
+            diffs.extend(self.diff_main(text1,text2,True,deadline))
+        self.diff_cleanupMerge(diffs)
+        return diffs
+
+    def diff_incremental(self,old_text1,old_text2,old_diffs,text1,text2,deadline=None):
+        """Diff two texts by updating the diff of earlier versions of them.
+
+        The common prefix and suffix of each old and new text are unchanged,
+        so the old diffs that lie within them are kept and only the region
+        between them is diffed again.  The time taken is in proportion to the
+        size of the changes, not to the length of the texts.  The result is a
+        valid diff from text1 to text2, but unlike a diff from scratch it is
+        not guaranteed to be minimal.
+
+        Args:
+            old_text1: Earlier version of text1.
+            old_text2: Earlier version of text2.
+            old_diffs: Array of changes from old_text1 to old_text2.
+            text1: Old string to be diffed.
+            text2: New string to be diffed.
+            deadline: Optional time when the diff should be complete by.
+
+        Returns:
+            Array of changes.
+        """
+        if deadline is None:
+            if self.Diff_Timeout<=0:
+                deadline=sys.maxsize
+            else:
+                deadline=time.time()+self.Diff_Timeout
+        prefix1=self.diff_commonPrefix(old_text1,text1)
+        prefix2=self.diff_commonPrefix(old_text2,text2)
+        suffix1=self.diff_commonSuffix(old_text1[prefix1:],text1[prefix1:])
+        suffix2=self.diff_commonSuffix(old_text2[prefix2:],text2[prefix2:])
+
+        # Keep the old diffs up to where either text changed.
+        head=[]
+        start1=0
+        start2=0
+        for (op,data) in old_diffs:
+            length=len(data)
+            if op==self.DIFF_EQUAL:
+                n=min(length,prefix1-start1,prefix2-start2)
+                if n>0:
+                    head.append((op,data[:n]))
+                    start1+=n
+                    start2+=n
+                if n<length:
+                    break
+            elif op==self.DIFF_DELETE:
+                if start1+length>prefix1:
+                    break
+                head.append((op,data))
+                start1+=length
+            else:
+                if start2+length>prefix2:
+                    break
+                head.append((op,data))
+                start2+=length
+
+        # Keep the old diffs after the last change, without overlapping the head.
+        tail=[]
+        end1=len(old_text1)
+        end2=len(old_text2)
+        for (op,data) in reversed(old_diffs):
+            length=len(data)
+            if op==self.DIFF_EQUAL:
+                n=min(length,suffix1-(len(old_text1)-end1),suffix2-(len(old_text2)-end2),end1-start1,end2-start2)
+                if n>0:
+                    tail.append((op,data[length-n:]))
+                    end1-=n
+                    end2-=n
+                if n<length:
+                    break
+            elif op==self.DIFF_DELETE:
+                if len(old_text1)-end1+length>suffix1 or end1-length<start1:
+                    break
+                tail.append((op,data))
+                end1-=length
+            else:
+                if len(old_text2)-end2+length>suffix2 or end2-length<start2:
+                    break
+                tail.append((op,data))
+                end2-=length
+        tail.reverse()
+
+        # Diff the changed region of the new texts.
+        end1=len(text1)-(len(old_text1)-end1)
+        end2=len(text2)-(len(old_text2)-end2)
+        diffs=head+self.diff_main(text1[start1:end1],text2[start2:end2],False,deadline)+tail
+        self.diff_cleanupMerge(diffs)
+        return diffs
+
+    def diff_lineBreaksToSpaces(self,diffs):
+        """Replace the line breaks of a diff with spaces.  A line break in one
+        text that is a space in the other becomes an equality, so the diff
+        becomes one between the texts with all line breaks replaced by spaces.
+
+        Args:
+            diffs: Array of diff tuples.  Modified in place.
+        """
+        for x in range(len(diffs)):
+            (op,data)=diffs[x]
+            if "\n" in data:
+                diffs[x]=(op,data.replace("\n"," "))
+        self.diff_cleanupMerge(diffs)
+
+    def diff_words(self,text):
+        """Split a text into word tokens"""
+        return word_re.findall(text)
+
+    def diff_wordsToChars(self,text1,text2):
+        """Reduce two texts to strings in which each character represents one
+        word token, in the same way as diff_linesToChars.
+
+        Args:
+            text1: First string.
+            text2: Second string.
+
+        Returns:
+            Three element tuple, containing the encoded text1, the encoded text2
+            and the array of unique tokens.  The zeroth element of the array is
+            intentionally blank.
+        """
+        wordArray=['']
+        wordHash={}
+
+        def diff_wordsToCharsMunge(text):
+            chars=[]
+            for word in word_re.findall(text):
+                if word not in wordHash:
+                    wordArray.append(word)
+                    wordHash[word]=len(wordArray)-1
+                chars.append(unichr(wordHash[word]))
+            return u''.join(chars)
+
+        chars1=diff_wordsToCharsMunge(text1)
+        chars2=diff_wordsToCharsMunge(text2)
+        return (chars1,chars2,wordArray)
+
+    def diff_wordMode(self,text1,text2,deadline=None):
+        """Diff two texts word by word.  The diff is much faster than a
+        character diff, but edits never split a word.
+
+        Args:
+            text1: Old string to be diffed.
+            text2: New string to be diffed.
+            deadline: Optional time when the diff should be complete by.
+
+        Returns:
+            Array of changes in terms of the original texts.
+        """
+        (chars1,chars2,wordArray)=self.diff_wordsToChars(text1,text2)
+        diffs=self.diff_main(chars1,chars2,False,deadline)
+        self.diff_charsToLines(diffs,wordArray)
+        return diffs
+
+    def diff_wordLevenshtein(self,diffs):
+        """Compute the Levenshtein distance in word tokens of a diff whose
+        edits are whole tokens, such as one from diff_wordMode.
+
+        Args:
+            diffs: Array of diff tuples.
+
+        Returns:
+            Number of inserted, deleted or substituted tokens.
+        """
+        return self.diff_levenshtein([(op,self.diff_words(data)) for (op,data) in diffs])
+
+    def diff_levenshteinRange(self,diffs,start1,end1,start2,end2):
+        """Compute the Levenshtein distance of the part of a diff that deletes
+        text1[start1:end1] or inserts text2[start2:end2], such as one section
+        of a report.
+
+        Args:
+            diffs: Array of diff tuples.
+            start1, end1: Range of text1.
+            start2, end2: Range of text2.
+
+        Returns:
+            Number of changes.
+        """
+        levenshtein=0
+        insertions=0
+        deletions=0
+        pos1=0
+        pos2=0
+        for (op,data) in diffs:
+            length=len(data)
+            if op==self.DIFF_INSERT:
+                insertions+=max(0,min(pos2+length,end2)-max(pos2,start2))
+                pos2+=length
+            elif op==self.DIFF_DELETE:
+                deletions+=max(0,min(pos1+length,end1)-max(pos1,start1))
+                pos1+=length
+            else:
+                levenshtein+=max(insertions,deletions)
+                insertions=0
+                deletions=0
+                pos1+=length
+                pos2+=length
+        levenshtein+=max(insertions,deletions)
+        return levenshtein
+
+    def diff_editDistance(self,text1,text2,max_distance=None):
+        """Compute the Levenshtein distance between two texts without diffing them.
+
+        Uses the bit-parallel algorithm of Myers (1999) in the form given by
+        Hyyro (2001).  A column of the edit distance matrix is held as bit
+        vectors in Python integers, so each character of text2 costs a few
+        integer operations on len(text1) bits instead of len(text1) steps.  The
+        common prefix and suffix are trimmed first.
+
+        Given an expected maximum distance, the banded search of
+        diff_bandedDistance is tried first, doubling the band each time the
+        distance turns out to be larger.  Its time grows with the square of
+        the distance rather than with the product of the lengths, so it is
+        much faster for lightly edited texts.  The result is exact either way.
+
+        Args:
+            text1: Old string.
+            text2: New string.
+            max_distance: Optional expected maximum distance.
+
+        Returns:
+            Number of inserted, deleted or substituted characters.
+        """
+        prefix=self.diff_commonPrefix(text1,text2)
+        text1=text1[prefix:]
+        text2=text2[prefix:]
+        suffix=self.diff_commonSuffix(text1,text2)
+        if suffix:
+            text1=text1[:-suffix]
+            text2=text2[:-suffix]
+        if max_distance is not None:
+            band=max(int(max_distance),abs(len(text1)-len(text2)),1)
+            # Past about the square root of the length, the bit vectors are faster
+            while band*band<=self.Diff_BandLimit*max(len(text1),len(text2)):
+                distance=self.diff_bandedDistance(text1,text2,band)
+                if distance is not None:
+                    return distance
+                band*=2
+        # The distance is symmetric, so the shorter text gives the bit vectors
+        if len(text1)>len(text2):
+            (text1,text2)=(text2,text1)
+        if not text1:
+            return len(text2)
+        # Bit i of peq[c] is set where text1[i] is c
+        peq={}
+        bit=1
+        for c in text1:
+            peq[c]=peq.get(c,0)|bit
+            bit<<=1
+        mask=bit-1
+        last=bit>>1
+        # Vertical positive and negative deltas of the current column
+        pv=mask
+        mv=0
+        score=len(text1)
+        for c in text2:
+            eq=peq.get(c,0)
+            xv=eq|mv
+            xh=(((eq&pv)+pv)^pv)|eq
+            ph=mv|(~(xh|pv)&mask)
+            mh=pv&xh
+            if ph&last:
+                score+=1
+            elif mh&last:
+                score-=1
+            # Shift in a positive delta, since the top row is 0, 1, 2, ...
+            ph=((ph<<1)|1)&mask
+            mh=(mh<<1)&mask
+            pv=mh|(~(xv|ph)&mask)
+            mv=ph&xv
+        return score
+
+    def diff_bandedDistance(self,text1,text2,max_distance):
+        """Compute the Levenshtein distance between two texts if it is at most
+        max_distance.
+
+        Ukkonen's (1985) diagonal search: for each number of edits e, it finds
+        the furthest point of the edit distance matrix that e edits can reach
+        on each diagonal within max_distance of the main one, sliding along
+        matching characters.  The time is O((e + slides) * e) for a distance
+        of e instead of O(len(text1) * len(text2)).
+
+        Args:
+            text1: Old string.
+            text2: New string.
+            max_distance: Maximum distance searched for.
+
+        Returns:
+            Number of inserted, deleted or substituted characters, or None if
+            it is more than max_distance.
+        """
+        text1_length=len(text1)
+        text2_length=len(text2)
+        # Diagonal k holds the points (x, x+k); the texts end on diagonal delta
+        delta=text2_length-text1_length
+        if abs(delta)>max_distance:
+            return None
+        offset=max_distance+1
+        # Furthest x reached on each diagonal, -1 if not reached yet
+        v=[-1]*(2*max_distance+3)
+        previous=list(v)
+        for d in range(max_distance+1):
+            (previous,v)=(v,previous)
+            for k in range(max(-d,-text1_length),min(d,text2_length)+1):
+                k_offset=offset+k
+                # Substitution along k, deletion from k+1, insertion from k-1.
+                # The first point of a diagonal is at most d edits away.
+                x=max(previous[k_offset]+1,previous[k_offset+1]+1,previous[k_offset-1],-k,0)
+                x=min(x,text1_length,text2_length-k)
+                y=x+k
+                # Slide along matching characters, a block at a time
+                while x+32<=text1_length and y+32<=text2_length and text1[x:x+32]==text2[y:y+32]:
+                    x+=32
+                    y+=32
+                while x<text1_length and y<text2_length and text1[x]==text2[y]:
+                    x+=1
+                    y+=1
+                v[k_offset]=x
+            if v[offset+delta]>=text1_length:
+                return d
+        return None
@@ -1,4 +1,4 @@
-#!/usr/bin/python2.4
+#!/usr/bin/python
 
 from __future__ import division
 
@@ -32,7 +32,24 @@ import math
 import re
 import sys
 import time
-import urllib
+
+PY3 = sys.version_info > (3,)
+if PY3:
+  from urllib.parse import quote, unquote
+  basestring = str
+  unichr = chr
+else:
+  import urllib
+  from urllib import quote
+  range = xrange
+
+  def unquote(text):
+    """Unescape %xx notation and decode the result as UTF-8."""
+    # Escaped text should be composed of a subset of ascii chars, Unicode not
+    # required.  If this encode raises UnicodeEncodeError, text is invalid.
+    if isinstance(text, unicode):
+      text = text.encode("ascii")
+    return urllib.unquote(text).decode("utf-8")
 
 class diff_match_patch:
   """Class containing the diff, match and patch methods.
@@ -98,7 +115,7 @@ class diff_match_patch:
     if deadline == None:
       # Unlike in most languages, Python counts time in seconds.
       if self.Diff_Timeout <= 0:
-        deadline = sys.maxint
+        deadline = sys.maxsize
       else:
         deadline = time.time() + self.Diff_Timeout
 
@@ -287,13 +304,13 @@ class diff_match_patch:
     k1end = 0
     k2start = 0
     k2end = 0
-    for d in xrange(max_d):
+    for d in range(max_d):
       # Bail out if deadline is reached.
       if time.time() > deadline:
         break
 
       # Walk the front path one step.
-      for k1 in xrange(-d + k1start, d + 1 - k1end, 2):
+      for k1 in range(-d + k1start, d + 1 - k1end, 2):
         k1_offset = v_offset + k1
         if k1 == -d or (k1 != d and
             v1[k1_offset - 1] < v1[k1_offset + 1]):
@@ -322,7 +339,7 @@ class diff_match_patch:
               return self.diff_bisectSplit(text1, text2, x1, y1, deadline)
 
       # Walk the reverse path one step.
-      for k2 in xrange(-d + k2start, d + 1 - k2end, 2):
+      for k2 in range(-d + k2start, d + 1 - k2end, 2):
         k2_offset = v_offset + k2
         if k2 == -d or (k2 != d and
             v2[k2_offset - 1] < v2[k2_offset + 1]):
@@ -445,7 +462,7 @@ class diff_match_patch:
       diffs: Array of diff tuples.
       lineArray: Array of unique strings.
     """
-    for x in xrange(len(diffs)):
+    for x in range(len(diffs)):
       text = []
       for char in diffs[x][1]:
         text.append(lineArray[ord(char)])
@@ -961,21 +978,14 @@ class diff_match_patch:
               text_insert = text_insert[:-commonlength]
               text_delete = text_delete[:-commonlength]
           # Delete the offending records and add the merged ones.
-          if count_delete == 0:
-            diffs[pointer - count_insert : pointer] = [
-                (self.DIFF_INSERT, text_insert)]
-          elif count_insert == 0:
-            diffs[pointer - count_delete : pointer] = [
-                (self.DIFF_DELETE, text_delete)]
-          else:
-            diffs[pointer - count_delete - count_insert : pointer] = [
-                (self.DIFF_DELETE, text_delete),
-                (self.DIFF_INSERT, text_insert)]
-          pointer = pointer - count_delete - count_insert + 1
-          if count_delete != 0:
-            pointer += 1
-          if count_insert != 0:
-            pointer += 1
+          new_ops = []
+          if len(text_delete) != 0:
+            new_ops.append((self.DIFF_DELETE, text_delete))
+          if len(text_insert) != 0:
+            new_ops.append((self.DIFF_INSERT, text_insert))
+          pointer -= count_delete + count_insert
+          diffs[pointer : pointer + count_delete + count_insert] = new_ops
+          pointer += len(new_ops) + 1
         elif pointer != 0 and diffs[pointer - 1][0] == self.DIFF_EQUAL:
           # Merge this equality with the previous one.
           diffs[pointer - 1] = (diffs[pointer - 1][0],
@@ -1041,7 +1051,7 @@ class diff_match_patch:
     chars2 = 0
     last_chars1 = 0
     last_chars2 = 0
-    for x in xrange(len(diffs)):
+    for x in range(len(diffs)):
       (op, text) = diffs[x]
       if op != self.DIFF_INSERT:  # Equality or deletion.
         chars1 += len(text)
@@ -1152,7 +1162,7 @@ class diff_match_patch:
       if op == self.DIFF_INSERT:
         # High ascii will raise UnicodeDecodeError.  Use Unicode instead.
         data = data.encode("utf-8")
-        text.append("+" + urllib.quote(data, "!~*'();/?:@&=+$,# "))
+        text.append("+" + quote(data, "!~*'();/?:@&=+$,# "))
       elif op == self.DIFF_DELETE:
         text.append("-%d" % len(data))
       elif op == self.DIFF_EQUAL:
@@ -1173,10 +1183,6 @@ class diff_match_patch:
     Raises:
       ValueError: If invalid input.
     """
-    if type(delta) == unicode:
-      # Deltas should be composed of a subset of ascii chars, Unicode not
-      # required.  If this encode raises UnicodeEncodeError, delta is invalid.
-      delta = delta.encode("ascii")
     diffs = []
     pointer = 0  # Cursor in text1
     tokens = delta.split("\t")
@@ -1188,7 +1194,7 @@ class diff_match_patch:
       # operation of this token (delete, insert, equality).
       param = token[1:]
       if token[0] == "+":
-        param = urllib.unquote(param).decode("utf-8")
+        param = unquote(param)
         diffs.append((self.DIFF_INSERT, param))
       elif token[0] == "-" or token[0] == "=":
         try:
@@ -1300,7 +1306,7 @@ class diff_match_patch:
     bin_max = len(pattern) + len(text)
     # Empty initialization added to appease pychecker.
     last_rd = None
-    for d in xrange(len(pattern)):
+    for d in range(len(pattern)):
       # Scan for the best match each iteration allows for one more error.
       # Run a binary search to determine how far from 'loc' we can stray at
       # this error level.
@@ -1320,7 +1326,7 @@ class diff_match_patch:
 
       rd = [0] * (finish + 2)
       rd[finish + 1] = (1 << d) - 1
-      for j in xrange(finish, start - 1, -1):
+      for j in range(finish, start - 1, -1):
         if len(text) <= j - 1:
           # Out of range.
           charMatch = 0
@@ -1363,7 +1369,7 @@ class diff_match_patch:
     s = {}
     for char in pattern:
       s[char] = 0
-    for i in xrange(len(pattern)):
+    for i in range(len(pattern)):
       s[pattern[i]] |= 1 << (len(pattern) - i - 1)
     return s
 
@@ -1437,7 +1443,6 @@ class diff_match_patch:
     """
     text1 = None
     diffs = None
-    # Note that texts may arrive as 'str' or 'unicode'.
     if isinstance(a, basestring) and isinstance(b, basestring) and c is None:
       # Method 1: text1, text2
       # Compute diffs from text1 and text2.
@@ -1472,7 +1477,7 @@ class diff_match_patch:
     char_count2 = 0  # Number of characters into the text2 string.
     prepatch_text = text1  # Recreate the patches to determine context info.
     postpatch_text = text1
-    for x in xrange(len(diffs)):
+    for x in range(len(diffs)):
       (diff_type, diff_text) = diffs[x]
       if len(patch.diffs) == 0 and diff_type != self.DIFF_EQUAL:
         # A new patch starts here.
@@ -1645,7 +1650,7 @@ class diff_match_patch:
     """
     paddingLength = self.Patch_Margin
     nullPadding = ""
-    for x in xrange(1, paddingLength + 1):
+    for x in range(1, paddingLength + 1):
       nullPadding += chr(x)
 
     # Bump all the patches forward.
@@ -1704,7 +1709,7 @@ class diff_match_patch:
       # Python has the option of not splitting strings due to its ability
       # to handle integers of arbitrary precision.
       return
-    for x in xrange(len(patches)):
+    for x in range(len(patches)):
       if patches[x].length1 <= patch_size:
         continue
       bigpatch = patches[x]
@@ -1806,10 +1811,6 @@ class diff_match_patch:
     Raises:
       ValueError: If invalid input.
     """
-    if type(textline) == unicode:
-      # Patches should be composed of a subset of ascii chars, Unicode not
-      # required.  If this encode raises UnicodeEncodeError, patch is invalid.
-      textline = textline.encode("ascii")
     patches = []
     if not textline:
       return patches
@@ -1847,8 +1848,7 @@ class diff_match_patch:
           sign = text[0][0]
         else:
           sign = ''
-        line = urllib.unquote(text[0][1:])
-        line = line.decode("utf-8")
+        line = unquote(text[0][1:])
         if sign == '+':
           # Insertion.
           patch.diffs.append((self.DIFF_INSERT, line))
@@ -1915,5 +1915,5 @@ class patch_obj:
         text.append(" ")
       # High ascii will raise UnicodeDecodeError.  Use Unicode instead.
       data = data.encode("utf-8")
-      text.append(urllib.quote(data, "!~*'();/?:@&=+$,# ") + "\n")
+      text.append(quote(data, "!~*'();/?:@&=+$,# ") + "\n")
     return "".join(text)
@@ -17,12 +17,19 @@ limitations under the License.
 
 from __future__ import print_function
 try:
-    from urllib.request import urlopen,Request
+    from http.client import HTTPConnection,HTTPSConnection,HTTPException
+    from urllib.parse import urlsplit
+    from urllib.error import HTTPError
 except ImportError:
-    from urllib2 import urlopen,Request
+    from httplib import HTTPConnection,HTTPSConnection,HTTPException
+    from urlparse import urlsplit
+    from urllib2 import HTTPError
 import xml.etree.ElementTree as ET
 import getpass
 import base64
+import threading
+import socket
+import time
 
 namespaces = {'b': 'http://schemas.datacontract.org/2004/07/Nuance.Radiology.Services.Contracts',
               'c': 'http://schemas.microsoft.com/2003/10/Serialization/Arrays',
@@ -36,13 +43,94 @@ def get_xml(elem,subelem):
     else:
         return None
                          
+class connection_pool():
+    """Pool of persistent keep-alive HTTP(S) connections to one server
+    
+    At most size connections are open, and so at most size requests are in
+    flight, at any time.  Connections unused for idle_timeout seconds are
+    closed, and a request that fails on a reused connection (e.g. one the
+    server has since dropped) is retried on another connection.
+    """
+    
+    def __init__(self,site,size=4,idle_timeout=60,timeout=None):
+        url=urlsplit(site)
+        self.scheme=url.scheme
+        self.host=url.hostname
+        self.port=url.port
+        self.size=size
+        self.idle_timeout=idle_timeout
+        self.timeout=timeout
+        self.idle=[]
+        self.lock=threading.Lock()
+        self.slots=threading.BoundedSemaphore(size)
+    
+    def connect(self):
+        kwargs={}
+        if self.timeout is not None:
+            kwargs['timeout']=self.timeout
+        if self.scheme=="https":
+            return HTTPSConnection(self.host,self.port,**kwargs)
+        return HTTPConnection(self.host,self.port,**kwargs)
+    
+    def checkout(self):
+        """Return a (connection, reused) pair, preferring the most recently used idle connection"""
+        now=time.time()
+        with self.lock:
+            while self.idle:
+                (conn,last_used)=self.idle.pop()
+                if now-last_used<self.idle_timeout:
+                    return (conn,True)
+                conn.close()
+        return (self.connect(),False)
+    
+    def checkin(self,conn):
+        with self.lock:
+            self.idle.append((conn,time.time()))
+    
+    def close(self):
+        with self.lock:
+            for (conn,last_used) in self.idle:
+                conn.close()
+            self.idle=[]
+    
+    def request(self,method,url,body=None,headers={}):
+        """Send a request and return the response body, raising HTTPError for error responses"""
+        path=urlsplit(url)
+        path=path.path+("?"+path.query if path.query else "")
+        with self.slots:
+            while True:
+                (conn,reused)=self.checkout()
+                try:
+                    conn.request(method,path,body,headers)
+                    response=conn.getresponse()
+                    data=response.read()
+                except (HTTPException,socket.error):
+                    conn.close()
+                    if reused:
+                        continue
+                    raise
+                break
+            if response.will_close:
+                conn.close()
+            else:
+                self.checkin(conn)
+        if response.status>=400:
+            raise HTTPError(url,response.status,response.reason,response.msg,None)
+        return data
+
 class ps_session():
     """Collection of methods using a connection to a Powerscribe 360 server
+    
+    A session may be shared between threads.  Requests reuse a pool of
+    max_concurrency keep-alive connections, so at most max_concurrency
+    requests are sent to the server at the same time.
     """
     
-    def __init__(self,site,username="",password=""):
+    def __init__(self,site,username="",password="",max_concurrency=4,idle_timeout=60):
         self.site=site    
         self.session=""
+        self.max_concurrency=max_concurrency
+        self.connections=connection_pool(site,max_concurrency,idle_timeout)
         self.SignIn(username,password)        
     
     def SignIn(self,username="",password=""):
@@ -75,8 +163,7 @@ class ps_session():
             
     def request(self, service, data):
         url=self.site+"/RAS/"+service
-        req=Request(url,data.encode('ascii'),headers={'Content-type':'application/soap+xml'})
-        return urlopen(req).read()
+        return self.connections.request("POST",url,data.encode('ascii'),{'Content-type':'application/soap+xml'})
     
     
     def SearchAccession(self,accession):
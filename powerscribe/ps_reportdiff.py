@@ -19,17 +19,72 @@ from __future__ import print_function
 #import xml.etree.ElementTree as ET
 from lxml import etree as ET
 import powerscribe
-import sqlite3
+from sqlite_db import connect,execute_sql,add_columns,iter_sql_chunks,batch_writer
+import report_store
+from report_store import normalize_report
+import diff_cache
+import report_sections
+import report_templates
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os,sys,getpass,base64,time,logging
 
-PY3=sys.version_info > (3,) 
-if PY3: 
-    import diff_match_patch3 as diff_match_patch
-else:
-    import diff_match_patch
+import diff_engine
+
+# VExplorer fields that change when a report is re-dictated.  Together with the
+# ReportID they identify a prelim version without fetching the report chain;
+# a row missing any of them has no version (see prelim_version).
+prelim_version_fields=('ReportStatus','LastModifiedDate')
+
+# Study updates are committed together every write_batch_rows rows or
+# write_batch_delay seconds, whichever comes first
+write_batch_rows=100
+write_batch_delay=1.0
+
+# Diff used for diff_score: "char" diffs character by character, "word" diffs
+# word tokens and scores the characters of the edited words.  The word-level
+# score is always computed.
+diff_mode="char"
+# Seconds allowed for scoring one report pair (0 for no limit).  The exact
+# word and character diffs share the first half; a diff that does not finish
+# in it falls back to a faster approximate diff in the rest (see
+# diff_engine.diff_bounded).  The edit distance is always exact and is not
+# counted; it takes well under a second even for the longest reports.
+diff_pair_budget=5.0
+# The next four settings make the character diff faster, but it is no longer
+# guaranteed to be minimal, so diff_score can be higher than with them off.
+# Studies scored with any of them on have diff_exact 0 and are not cached.
+# Diff each aligned pair of report sections on its own instead of the whole
+# reports (see report_sections).  Much faster for long reports, but edits
+# cannot match text in a different section.  Per-section scores are stored in
+# section_score either way.
+diff_by_section=False
+# Keep the line breaks of the normalized reports for the character diff, so
+# that diff_main's line-level pass can skip unchanged lines.  Line breaks are
+# scored as spaces, so the scores still ignore formatting.
+line_mode=False
+# Diff the template lines (see report_templates) that a prelim and its final
+# both contain as fixed equalities, and only search the text between them.
+# Needs line_mode.
+template_anchors=False
+# Diff a re-dictated study by updating the diff of its earlier scored versions
+# (diff_engine.diff_incremental) instead of from scratch.
+incremental_diff=False
+# Also store the plain character edit distance of each pair
+# (study.edit_distance).  It is kept for reference only and costs a scan of
+# the study table every cycle, so it is off by default; rescore.py fills it
+# in for a whole database instead.
+edit_distance_scores=False
+# The edit distance of each pair is searched for in a band around the
+# expected distance (diff_engine.diff_editDistance): edit_bound_factor times
+# the average diff_score_percent of the resident or attending, whichever is
+# higher, or edit_bound_default percent for readers with no scored studies.
+# The band is widened if the distance is larger, so the scores are exact.
+edit_bound_factor=2.0
+edit_bound_default=10.0
 
 def create_sqlite_table(dbfile):
-    conn=sqlite3.connect(dbfile)
+    conn=connect(dbfile)
     c=conn.cursor()
     create_sql="""create table if not exists study(
                     site text,
@@ -48,77 +103,161 @@ def create_sqlite_table(dbfile):
                     final_timestamp text,
                     diff_score int,
                     diff_score_percent real,
+                    word_diff_score int,
+                    word_diff_score_percent real,
+                    diff_exact int,
+                    diff_delta text,
+                    previous_diff_delta text,
+                    template_percent real,
+                    edit_distance int,
+                    edit_distance_percent real,
+                    primary key(accession) );"""
+    c.execute(create_sql)
+    add_columns(dbfile,"study",[("word_diff_score","int"),("word_diff_score_percent","real"),("diff_exact","int"),("diff_delta","text"),
+                                ("previous_diff_delta","text"),("template_percent","real"),("edit_distance","int"),
+                                ("edit_distance_percent","real")])
+    # Partial indexes for the retriever's pending states, so each cycle only
+    # touches pending rows, plus indexes for the analysis queries.  Report text
+    # lives in report_text, so the pending states key off final_timestamp.
+    for create_sql in ["""create index if not exists study_awaiting_final on study(accession) where final_timestamp is null""",
+                       """create index if not exists study_awaiting_diff on study(accession) where final_timestamp is not null and diff_score is null""",
+                       """create index if not exists study_resident on study(residentID,prelim_timestamp)""",
+                       """create index if not exists study_attending on study(attendingID,prelim_timestamp)""",
+                       """create index if not exists study_prelim_timestamp on study(prelim_timestamp)"""]:
+        c.execute(create_sql)
+    create_sql="""create table if not exists prelim_index(
+                    accession text,
+                    reportID text,
+                    version text,
                     primary key(accession) );"""
     c.execute(create_sql)
+    # Edit scores of each report section (see score_diff)
+    create_sql="""create table if not exists section_score(
+                    accession text,
+                    section text,
+                    diff_score int,
+                    diff_score_percent real,
+                    primary key(accession,section) );"""
+    c.execute(create_sql)
+    c.execute("""create index if not exists section_score_section on section_score(section)""")
     c.close()
-    conn.close()
+    conn.commit()
+    report_store.create_report_table(dbfile)
+    diff_cache.create_cache_table(dbfile)
+    report_templates.create_template_table(dbfile)
 
-def execute_sql(dbfile,query,params=None):
-    conn=sqlite3.connect(dbfile)
-    conn.row_factory=sqlite3.Row
-    c=conn.cursor()
-    
+def fetch_report_chain(ps,reportID):
+    """Fetch a report chain, logging instead of raising so one failure does not stop a fetch batch"""
     try:
-        if params is None:
-            c.execute(query)
-        else:
-            c.execute(query,params)
-        res=c.fetchall()
-    except sqlite3.OperationalError as e:
-        print(e)
-        res=None
-    c.close()
-    conn.commit()
-    conn.close()
-    return res
-      
-def get_prelims(ps,dbfile):   
+        return ps.GetReportChain(reportID)
+    except:
+        logging.exception("Error fetching report chain {0}".format(reportID))
+        return None
+
+def prelim_version(elem):
+    """Version key of a VExplorer row, or None if the row lacks any version field
+    
+    ReportStatus is the same for every row of the PendingSignature query, so a
+    key without LastModifiedDate would never change when a prelim is
+    re-dictated.  Rows without a key are always fetched.
+    """
+    fields=[powerscribe.get_xml(elem,'.//'+field) for field in prelim_version_fields]
+    if any(field is None for field in fields):
+        return None
+    return '|'.join([powerscribe.get_xml(elem,'.//ReportID') or '']+[field or '' for field in fields])
+
+def get_prelims(ps,dbfile,threads=None):
+    """Add new or updated trainee prelims from the past week
+    
+    Report chains are fetched by a pool of threads; the number of requests in
+    flight is limited by the session's max_concurrency.  Prelims whose VExplorer
+    version matches the one recorded in prelim_index are not fetched again.
+    
+    Args:
+        ps: powerscribe.ps_session
+        dbfile: SQLite database file
+        threads: number of fetch threads (defaults to ps.max_concurrency)
+    """
     print("Checking prelims...")
     result=ps.BrowseOrdersDV(period="PastWeek",orderStatus="Completed",reportStatus="PendingSignature")
     root=ET.fromstring(result, parser=parser)
     prelimset=root.findall('.//VExplorer')
-    total_prelims=0
+    known_versions=dict(execute_sql(dbfile,"""select prelim_index.accession, prelim_index.version from prelim_index
+                            join study on study.accession=prelim_index.accession"""))
+    candidates=[]
     for elem in prelimset:
-        try:
-            total_prelims+=1
-            if powerscribe.get_xml(elem,'.//DictatorLastName') is None: continue
-            if powerscribe.get_xml(elem,'.//IsAddendum')!="false": continue
-            accession=powerscribe.get_xml(elem,'.//Accession')
-            
-            reportID=powerscribe.get_xml(elem,'.//ReportID')
+        if powerscribe.get_xml(elem,'.//DictatorLastName') is None: continue
+        if powerscribe.get_xml(elem,'.//IsAddendum')!="false": continue
+        accession=powerscribe.get_xml(elem,'.//Accession')
+        version=prelim_version(elem)
+        if version is not None and known_versions.get(accession)==version: continue
+        candidates.append((accession,powerscribe.get_xml(elem,'.//ReportID'),version))
+    print("{0}/{1} prelims new or changed".format(len(candidates),len(prelimset)))
+    
+    if threads is None:
+        threads=ps.max_concurrency
+    pool=ThreadPool(max(1,threads))
+    chains=pool.imap(lambda candidate: fetch_report_chain(ps,candidate[1]),candidates)
+    writer=batch_writer(dbfile,write_batch_rows,write_batch_delay)
+    total_prelims=0
+    try:
+        for ((accession,reportID,version),result) in zip(candidates,chains):
+            try:
+                total_prelims+=1
+                if result is None: continue
+                report_root=ET.fromstring(result, parser=parser)
             
-            result=ps.GetReportChain(reportID)
-            report_root=ET.fromstring(result, parser=parser)
+                prelim_timestamp=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:LastDraftDate')
+                check_prelim=execute_sql(dbfile,"select prelim_timestamp, diff_delta, previous_diff_delta from study where accession=?",(accession,))
+                if len(check_prelim)>0 and prelim_timestamp==check_prelim[0][0]:
+                    writer.add("replace into prelim_index (accession,reportID,version) values (?,?,?)",(accession,reportID,version))
+                    writer.commit_point()
+                    continue
             
-            prelim_timestamp=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:LastDraftDate')
-            check_prelim=execute_sql(dbfile,"select prelim_timestamp from study where accession=?",(accession,))
-            if len(check_prelim)>0 and prelim_timestamp==check_prelim[0][0]:
-                continue
+                # Keep the scored versions of a re-dictated study, so that its next
+                # diff can update the previous one (see incremental_diff)
+                previous_delta=None
+                if incremental_diff and len(check_prelim)>0:
+                    previous_delta=check_prelim[0]["previous_diff_delta"]
+                    if check_prelim[0]["diff_delta"] is not None:
+                        previous_delta=check_prelim[0]["diff_delta"]
+                        report_store.keep_previous_reports(writer,accession)
             
-            print("{0}/{1}: updating prelim {2}".format(total_prelims,len(prelimset),accession), end=' ')
+                print("{0}/{1}: updating prelim {2}".format(total_prelims,len(candidates),accession), end=' ')
             
-            dictator_lastname=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:Person/b:LastName')
-            dictator_firstname=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:Person/b:FirstName')
-            dictatorID=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:AccountID')
-            dictator="{0} {1}".format(dictator_firstname,dictator_lastname)
-            prelim=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:ContentText')
-            modality=powerscribe.get_xml(report_root,'.//b:DiagnosticServSect')
-            proceduredescription=powerscribe.get_xml(report_root,'.//b:ProcedureDescList')
-            procedure_code=powerscribe.get_xml(report_root,'.//b:ProcedureCodeList')
-            timestamp=powerscribe.get_xml(report_root,'.//b:CompleteDate')
+                dictator_lastname=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:Person/b:LastName')
+                dictator_firstname=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:Person/b:FirstName')
+                dictatorID=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:Dictator/b:AccountID')
+                dictator="{0} {1}".format(dictator_firstname,dictator_lastname)
+                prelim=powerscribe.get_xml(report_root,'.//b:OriginalReport/b:ContentText')
+                modality=powerscribe.get_xml(report_root,'.//b:DiagnosticServSect')
+                proceduredescription=powerscribe.get_xml(report_root,'.//b:ProcedureDescList')
+                procedure_code=powerscribe.get_xml(report_root,'.//b:ProcedureCodeList')
+                timestamp=powerscribe.get_xml(report_root,'.//b:CompleteDate')
             
             
             
-            execute_sql(dbfile,"""replace into study (site,accession,timestamp,proceduredescription,procedurecode,
-                                modality,resident,residentID,prelim,prelim_timestamp)
-                            values (?,?,?,?,?,?,?,?,?,?)""",
-                    (ps.site,accession,timestamp,proceduredescription,procedure_code,modality,dictator,dictatorID,prelim,prelim_timestamp))   
-            print()
-        except:
-            logging.exception("Error!")
-            
+                writer.add("""replace into study (site,accession,timestamp,proceduredescription,procedurecode,
+                                    modality,resident,residentID,prelim_timestamp,previous_diff_delta)
+                                values (?,?,?,?,?,?,?,?,?,?)""",
+                        (ps.site,accession,timestamp,proceduredescription,procedure_code,modality,dictator,dictatorID,prelim_timestamp,
+                         previous_delta))   
+                report_store.put_report(writer,accession,"prelim",prelim)
+                writer.add("replace into prelim_index (accession,reportID,version) values (?,?,?)",(accession,reportID,version))
+                # The study row, its prelim and its version are written together
+                writer.commit_point()
+                print()
+            except:
+                logging.exception("Error!")
+                writer.discard()
+    finally:
+        writer.close()
+        pool.close()
+        pool.join()
+        
 def get_finals(ps,dbfile):
-    prelimset=execute_sql(dbfile,"select accession from study where final is NULL")
+    prelimset=execute_sql(dbfile,"select accession from study where final_timestamp is NULL")
+    writer=batch_writer(dbfile,write_batch_rows,write_batch_delay)
     total_finals=0
     total_prelims=0
     for row in prelimset:
@@ -133,7 +272,10 @@ def get_finals(ps,dbfile):
             
             if reportID is None:
                 print("Missing reportID!")
-                execute_sql(dbfile,"""delete from study where accession=?""",(accession,))
+                writer.add("""delete from study where accession=?""",(accession,))
+                writer.add("""delete from section_score where accession=?""",(accession,))
+                report_store.delete_reports(writer,accession)
+                writer.commit_point()
                 continue
                 
             result=ps.GetReportChain(reportID)
@@ -141,45 +283,253 @@ def get_finals(ps,dbfile):
             
             reportStatus=powerscribe.get_xml(root,'.//b:OriginalReport/b:ReportStatus')
     
-            if reportStatus=="Final":
+            final=powerscribe.get_xml(root,'.//b:OriginalReport/b:ContentText')
+            # A study stays pending until its final_timestamp is set, so a final without text is fetched again
+            if reportStatus=="Final" and not final:
+                print("... final report is empty", end=' ')
+            elif reportStatus=="Final":
                 print("... adding final report", end=' ')
-                final=powerscribe.get_xml(root,'.//b:OriginalReport/b:ContentText')
                 signer_lastname=powerscribe.get_xml(root,'.//b:Signer/b:Person/b:LastName')
                 signer_firstname=powerscribe.get_xml(root,'.//b:OriginalReport/b:Signer/b:Person/b:FirstName')
                 signerID=powerscribe.get_xml(root,'.//b:OriginalReport/b:Signer/b:AccountID')
                 signer="{0} {1}".format(signer_firstname,signer_lastname)
                 final_timestamp=powerscribe.get_xml(root,'.//b:OriginalReport/b:LastSignDate')
-                execute_sql(dbfile,"""update study set attending=?, attendingID=?, final=?, final_timestamp=? where accession=?""",
-                        (signer, signerID, final, final_timestamp, accession))
+                if final_timestamp is None:
+                    # Mark the study final anyway, or it would be fetched again every cycle
+                    final_timestamp=time.strftime("%Y-%m-%dT%H:%M:%S")
+                writer.add("""update study set attending=?, attendingID=?, final_timestamp=? where accession=?""",
+                        (signer, signerID, final_timestamp, accession))
+                report_store.put_report(writer,accession,"final",final)
+                writer.commit_point()
                 total_finals+=1
             print()
         except:
             logging.exception("Error!")
+            writer.discard()
+    writer.close()
     print("Added {0}/{1} final reports".format(total_finals,total_prelims))
 
-def get_diffs(dbfile):
-    dmp=diff_match_patch.diff_match_patch()
+def score_diff(pair):
+    """Compute the edit scores between a prelim and its final report
+    
+    Runs in the diff worker processes, so it only depends on its argument.
+    
+    With line_mode, the character diff runs on the line-normalized reports
+    and its line breaks are then scored as spaces.  With diff_by_section, the
+    aligned sections of the two reports are diffed separately
+    (diff_engine.diff_sections).  Either way, each section is scored on the
+    part of the whole diff that edits it.  With template_anchors, the
+    template lines the two reports share are split off as equalities first
+    (report_templates.anchor_pieces).  Unless max_distance is None, the
+    plain edit distance of the reports is computed without a diff, by a
+    banded search around max_distance.  A diff that does not rebuild both
+    reports is replaced by a plain diff of the whole reports before it is
+    scored.
+    
+    With previous, a re-dictated study is diffed by updating the diff of
+    its earlier scored versions (diff_engine.diff_incremental), which only
+    re-diffs the changed regions.  Its diff_exact is 0, since the updated
+    diff is not guaranteed to be minimal, so it is never cached.  If the
+    earlier diff does not decode against the earlier reports, as after a
+    change to the normalizer, the study is diffed from scratch instead.
+    
+    Args:
+        pair: (key, prelim sections, final sections, previous, anchors,
+            max_distance) tuple; the sections are from
+            report_sections.split_sections.  previous is None, or the normalized
+            (prelim, final, delta) of the earlier scored versions, given with
+            incremental_diff.  anchors is the set of template lines of both
+            reports.  max_distance is the expected maximum edit distance, or
+            None to skip the edit distance.
+    
+    Returns:
+        (key, scores, delta, section scores) tuple.  scores is (diff_score,
+        diff_score_percent, word_diff_score, word_diff_score_percent, diff_exact,
+        edit_distance, edit_distance_percent); the edit distances are None
+        if max_distance is None.  diff_exact is 0 if either diff ran out of
+        time and fell back to an approximate diff, or if the character diff
+        was sectioned, anchored, in line mode or incremental.
+        delta is the semantically cleaned-up diff in diff_toDelta format.
+        section scores is a list of (section, diff_score, diff_score_percent);
+        the percent is None for a section the final lacks.
+    """
+    (key,prelim_sections,final_sections,previous,anchors,max_distance)=pair
+    separator='\n' if line_mode else ' '
+    prelim_text=report_sections.section_text(prelim_sections,separator)
+    final_text=report_sections.section_text(final_sections,separator)
+    prelim_strip=prelim_text.replace('\n',' ')
+    final_strip=final_text.replace('\n',' ')
+    (pieces,ranges)=report_sections.align_sections(prelim_sections,final_sections,separator)
+    dmp=diff_engine.diff_engine()
     dmp.Diff_Timeout=0
-    finalset=execute_sql(dbfile,"select * from study where final is not null and diff_score is null")
-    for row in finalset:
-        accession=row["accession"]
-        print("Diff for "+accession)
-        prelim=row["prelim"]
-        final=row["final"]
-        if prelim is not None and final is not None:
-            prelim_strip=' '.join(prelim.replace("-"," ").split())
-            final_strip=' '.join(final.replace("-"," ").split())
-            if len(final_strip)>0:
-                d=dmp.diff_main(prelim_strip,final_strip)
-                dmp.diff_cleanupSemantic(d)
-                diffscore=dmp.diff_levenshtein(d)
-                diffpercent=diffscore*100.0/len(final_strip)
-                execute_sql(dbfile,"""update study set diff_score=?, diff_score_percent=? where accession=?""",
-                        (diffscore,diffpercent,accession))
+    # One budget for the whole pair: exact diffs until deadline, fallbacks until end
+    if diff_pair_budget>0:
+        start=time.time()
+        deadline=start+diff_pair_budget/2.0
+        end=start+diff_pair_budget
+    else:
+        deadline=end=sys.maxsize
+    (word_diffs,word_exact)=dmp.diff_bounded(prelim_strip,final_strip,deadline,end,words=True)
+    wordscore=dmp.diff_wordLevenshtein(word_diffs)
+    wordpercent=wordscore*100.0/len(dmp.diff_words(final_strip))
+    if diff_mode=="word":
+        (d,exact)=(word_diffs,word_exact)
+    else:
+        d=None
+        dmp.Diff_TimedOut=False
+        if previous is not None:
+            (previous_prelim,previous_final,previous_delta)=previous
+            try:
+                previous_diffs=dmp.diff_fromDelta(previous_prelim,previous_delta)
+            except ValueError:
+                previous_diffs=None
+            # The earlier diff does not fit reports normalized differently since (or stored corrupt); diff from scratch
+            if previous_diffs is None or dmp.diff_text2(previous_diffs)!=previous_final:
+                previous=None
+            else:
+                d=dmp.diff_incremental(previous_prelim,previous_final,previous_diffs,prelim_strip,final_strip,deadline)
+                exact=False
+        if previous is None:
+            if not diff_by_section:
+                pieces=[(prelim_text,final_text)]
+            pieces=report_templates.anchor_pieces(pieces,anchors)
+            if len(pieces)>1:
+                d=dmp.diff_sections(pieces,deadline)
+                # Edits cannot match across pieces, so the diff may not be minimal
+                exact=False
+        if dmp.Diff_TimedOut:
+            d=None
+        if d is None:
+            (d,exact)=dmp.diff_bounded(prelim_text,final_text,deadline,end)
+            # Nor may a diff that went through diff_main's line-level pass
+            exact=exact and not line_mode
+        dmp.diff_lineBreaksToSpaces(d)
+    dmp.diff_cleanupSemantic(d)
+    # Never score, store or cache a diff that does not rebuild both reports; the faster modes go through more of
+    # diff_match_patch's cleanup code, which has dropped text before
+    if dmp.diff_text1(d)!=prelim_strip or dmp.diff_text2(d)!=final_strip:
+        (d,exact)=dmp.diff_bounded(prelim_strip,final_strip,deadline,end,words=(diff_mode=="word"))
+        dmp.diff_cleanupSemantic(d)
+    diffscore=dmp.diff_levenshtein(d)
+    diffpercent=diffscore*100.0/len(final_strip)
+    if max_distance is None:
+        (distance,distancepercent)=(None,None)
+    else:
+        # The diff's Levenshtein distance is an upper bound of the edit distance
+        distance=dmp.diff_editDistance(prelim_strip,final_strip,min(max_distance,diffscore))
+        distancepercent=distance*100.0/len(final_strip)
+    sections={}
+    for (name,start1,end1,start2,end2) in ranges:
+        if name not in sections:
+            sections[name]=[0,0]
+        sections[name][0]+=dmp.diff_levenshteinRange(d,start1,end1,start2,end2)
+        sections[name][1]+=end2-start2
+    section_scores=[(name,score,score*100.0/length if length>0 else None) for (name,(score,length)) in sections.items()]
+    return (key,(diffscore,diffpercent,wordscore,wordpercent,int(exact and word_exact),distance,distancepercent),
+            dmp.diff_toDelta(d),section_scores)
+
+def get_diffs(dbfile,processes=1,chunk_size=200):
+    """Score all studies with a final report but no diff score
+    
+    Pending rows are read and scored chunk_size at a time, so memory use does
+    not grow with the size of the backlog.  Pairs already in the diff cache,
+    and repeats of a pair within a chunk, are not diffed again; only exact
+    scores are added to the cache.  Each study's
+    template_percent is computed from the template index as it is scored.
+    With edit_distance_scores, the expected edit distance of each pair comes
+    from the diff_score_percent history of its resident and attending (see
+    edit_bound_factor).
+    
+    Args:
+        dbfile: SQLite database file
+        processes: number of worker processes used for scoring (1 scores in this process)
+        chunk_size: number of pending rows read at a time
+    """
+    pool=None
+    settings=(diff_mode,diff_pair_budget,diff_by_section,line_mode,template_anchors,incremental_diff,edit_distance_scores)
+    templates=report_templates.get_template_index(dbfile)
+    history=None
+    writer=batch_writer(dbfile,write_batch_rows,write_batch_delay)
+    try:
+        for chunk in iter_sql_chunks(dbfile,"select accession, residentID, attendingID, previous_diff_delta, "+report_store.report_columns+", "+
+                                     report_store.previous_report_columns+
+                                     " from study where final_timestamp is not null and diff_score is null",chunk_size=chunk_size):
+            # Read the score history only once there is something to score, since each reader's average
+            # is a scan of the whole study table
+            if edit_distance_scores and history is None:
+                history={}
+                for reader in ("residentID","attendingID"):
+                    history[reader]=dict(execute_sql(dbfile,"select "+reader+", avg(diff_score_percent) from study where diff_score_percent is not null group by "+
+                                                     reader) or [])
+            studies=[]
+            pairs={}
+            for row in chunk:
+                prelim=report_store.decode_report(dbfile,row["prelim"])
+                final=report_store.decode_report(dbfile,row["final"])
+                if prelim is None or final is None:
+                    continue
+                prelim_sections=report_sections.split_sections(prelim,lines=line_mode)
+                final_sections=report_sections.split_sections(final,lines=line_mode)
+                if len(final_sections)==0:
+                    continue
+                prelim_lines=report_store.normalize_lines(prelim)
+                final_lines=report_store.normalize_lines(final)
+                anchors=templates.common_lines(prelim_lines,final_lines) if template_anchors and line_mode else frozenset()
+                # Key on the section texts, so that the same text split into different sections is scored again,
+                # and on the anchors, so that a change to the template index rescores the pairs it affects
+                key=diff_cache.cache_key('\n\n'.join(text for (name,text) in prelim_sections),
+                                         '\n\n'.join(text for (name,text) in final_sections),settings+(sorted(anchors),))
+                previous=None
+                if incremental_diff and row["previous_diff_delta"] is not None:
+                    previous_prelim=report_store.decode_report(dbfile,row["prelim_previous"])
+                    previous_final=report_store.decode_report(dbfile,row["final_previous"])
+                    if previous_prelim is not None and previous_final is not None:
+                        previous=(normalize_report(previous_prelim),normalize_report(previous_final),row["previous_diff_delta"])
+                max_distance=None
+                if edit_distance_scores:
+                    percents=[history[reader][row[reader]] for reader in history if row[reader] in history[reader]]
+                    percent=max(percents)*edit_bound_factor if percents else edit_bound_default
+                    max_distance=int(len(final_lines)*percent/100)+1
+                studies.append((row["accession"],key,row["previous_diff_delta"] is not None,templates.template_percent(final_lines)))
+                pairs[key]=(key,prelim_sections,final_sections,previous,anchors,max_distance)
+            cached=diff_cache.get_cached(dbfile,pairs)
+            missing=[pairs[key] for key in pairs if key not in cached]
+            if processes>1 and len(missing)>1:
+                if pool is None:
+                    pool=multiprocessing.Pool(processes)
+                results=pool.imap_unordered(score_diff,missing,chunksize=max(1,len(missing)//(processes*4)))
+            else:
+                results=(score_diff(pair) for pair in missing)
+            for (key,scores,delta,section_scores) in results:
+                cached[key]=(scores,delta,section_scores)
+                # Only minimal diffs are cached: the key does not cover the earlier diff an incremental one was
+                # built from, and an approximate one may be exact when rescored
+                if scores[diff_cache.score_columns.index("diff_exact")]:
+                    diff_cache.put_cached(writer,key,scores,delta,section_scores)
+                writer.commit_point()
+            for (accession,key,redictated,template_percent) in studies:
+                print("Diff for "+accession)
+                (scores,delta,section_scores)=cached[key]
+                writer.add("""update study set diff_score=?, diff_score_percent=?, word_diff_score=?, word_diff_score_percent=?,
+                                diff_exact=?, edit_distance=?, edit_distance_percent=?, diff_delta=?, previous_diff_delta=null, template_percent=? where accession=?""",
+                           scores+(delta,template_percent,accession))
+                writer.add("""delete from section_score where accession=?""",(accession,))
+                for (section,score,percent) in section_scores:
+                    writer.add("""insert into section_score (accession,section,diff_score,diff_score_percent) values (?,?,?,?)""",
+                               (accession,section,score,percent))
+                if redictated:
+                    report_store.delete_previous_reports(writer,accession)
+                writer.commit_point()
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 if __name__=='__main__':    
     site="http://calv-psapp"
     dbfile='reportdiff_ps.db'
+    diff_processes=multiprocessing.cpu_count()
     create_sqlite_table(dbfile)
     
     try:
@@ -200,8 +550,10 @@ if __name__=='__main__':
         try:
             ps=powerscribe.ps_session(site,username,pwd)
             get_prelims(ps,dbfile)
-            get_finals(ps,dbfile)         
-            get_diffs(dbfile)
+            get_finals(ps,dbfile)
+            report_store.train_dictionary(dbfile)
+            report_templates.update_template_index(dbfile)
+            get_diffs(dbfile,processes=diff_processes)
         except:
             logging.exception("Error!")
     
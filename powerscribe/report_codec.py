@@ -0,0 +1,195 @@
+"""ReportDiff report text compression
+
+Report bodies are compressed with zlib, optionally primed with a preset
+dictionary trained from the stored reports.  Radiology reports repeat the same
+templated sentences, so a dictionary of the most common lines lets even a
+short report compress well.
+
+Compressed text is stored as a blob holding a format byte, the id of the
+dictionary (0 for none) and the zlib stream.  Uncompressed text is stored as
+text, and decompress() accepts either.
+
+Run as a script to compare the size and speed of the methods on the reports
+in a database:
+
+    python report_codec.py reportdiff_ps.db
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import sqlite3
+import zlib
+import struct
+import collections
+import os,sys,time
+from sqlite_db import connect,execute_sql
+
+compression_level=6
+# A zlib window is 32 KiB, so a larger dictionary would not be used
+dictionary_size=32768
+# Preset dictionaries need zlib's zdict support (Python 3.3+)
+dictionary_supported=sys.version_info>=(3,3)
+
+header=struct.Struct('>BI')
+format_zlib=1
+
+def create_dictionary_table(dbfile):
+    conn=connect(dbfile)
+    conn.execute("""create table if not exists compression_dictionary(
+                    id integer primary key,
+                    content blob,
+                    created text );""")
+    conn.commit()
+
+def train_dictionary(texts,size=dictionary_size):
+    """Build a preset dictionary from the lines that recur across reports
+    
+    Args:
+        texts: iterable of report texts
+        size: maximum dictionary size in bytes
+    
+    Returns:
+        dictionary as bytes
+    """
+    counts=collections.Counter()
+    for text in texts:
+        counts.update(set(line.strip() for line in text.splitlines() if line.strip()))
+    lines=[line for line in counts if counts[line]>1]
+    lines.sort(key=lambda line: counts[line]*len(line),reverse=True)
+    chosen=[]
+    total=0
+    for line in lines:
+        line=line.encode('utf-8')
+        if total+len(line)+1>size: continue
+        chosen.append(line)
+        total+=len(line)+1
+    # Matches close to the end of the dictionary are the cheapest to encode,
+    # so the most valuable lines go last
+    chosen.reverse()
+    return b'\n'.join(chosen)
+
+class report_codec():
+    """Compresses and decompresses report text
+    
+    Args:
+        dictionaries: dict of dictionary id to dictionary bytes, used for decompression
+        dictionary_id: id of the dictionary used for compression (0 for none)
+        dbfile: database the dictionaries are stored in.  Content compressed
+            with a dictionary added since they were read reloads them.
+    """
+    
+    def __init__(self,dictionaries={},dictionary_id=0,dbfile=None):
+        self.dictionaries=dictionaries
+        self.dictionary_id=dictionary_id
+        self.dbfile=dbfile
+    
+    def reload(self):
+        """Read the dictionaries again, and compress with the newest one from now on"""
+        self.dictionaries=load_dictionaries(self.dbfile)
+        self.dictionary_id=max(self.dictionaries) if self.dictionaries and dictionary_supported else 0
+    
+    def compress(self,text):
+        """Return text compressed for storage, or None for None"""
+        if text is None:
+            return None
+        if self.dictionary_id:
+            compressor=zlib.compressobj(compression_level,zlib.DEFLATED,zlib.MAX_WBITS,9,zlib.Z_DEFAULT_STRATEGY,self.dictionaries[self.dictionary_id])
+        else:
+            compressor=zlib.compressobj(compression_level)
+        data=compressor.compress(text.encode('utf-8'))+compressor.flush()
+        return sqlite3.Binary(header.pack(format_zlib,self.dictionary_id)+data)
+    
+    def decompress(self,content):
+        """Return the text of stored content, which may be compressed or plain text"""
+        if content is None or isinstance(content,type(u'')):
+            return content
+        content=bytes(content)
+        (fmt,dictionary_id)=header.unpack_from(content)
+        if fmt!=format_zlib:
+            raise ValueError("Unknown report compression format {0}".format(fmt))
+        if dictionary_id:
+            if dictionary_id not in self.dictionaries and self.dbfile is not None:
+                self.reload()
+            decompressor=zlib.decompressobj(zlib.MAX_WBITS,self.dictionaries[dictionary_id])
+        else:
+            decompressor=zlib.decompressobj()
+        data=decompressor.decompress(content[header.size:])+decompressor.flush()
+        return data.decode('utf-8')
+
+def load_dictionaries(dbfile):
+    """Return the dictionaries stored in a database, as a dict of id to bytes"""
+    rows=execute_sql(dbfile,"select id, content from compression_dictionary order by id")
+    return dict((row["id"],bytes(row["content"])) for row in rows or [])
+
+codecs={}
+
+def get_codec(dbfile):
+    """Return this process's codec for a database, using its newest dictionary"""
+    key=(os.getpid(),dbfile)
+    codec=codecs.get(key)
+    if codec is None:
+        codec=report_codec(dbfile=dbfile)
+        codec.reload()
+        codecs[key]=codec
+    return codec
+
+def add_dictionary(dbfile,dictionary):
+    """Store a new dictionary, which is used for all reports compressed from now on"""
+    execute_sql(dbfile,"insert into compression_dictionary (content,created) values (?,datetime('now'))",(sqlite3.Binary(dictionary),))
+    codecs.pop((os.getpid(),dbfile),None)
+
+def benchmark(texts):
+    """Compare compression methods on a list of report texts
+    
+    The dictionary is trained on the first half of the texts and measured on
+    the second half, so it is not scored on the reports it was built from.
+    
+    Returns:
+        list of (method, raw bytes, stored bytes, compress MB/s, decompress MB/s)
+    """
+    half=len(texts)//2
+    (training,texts)=(texts[:half],texts[half:])
+    raw=sum(len(text.encode('utf-8')) for text in texts)
+    methods=[("zlib",report_codec())]
+    if dictionary_supported:
+        methods.append(("zlib+dictionary",report_codec({1:train_dictionary(training)},1)))
+    results=[]
+    for (method,codec) in methods:
+        start=time.time()
+        stored=[codec.compress(text) for text in texts]
+        compress_time=time.time()-start
+        start=time.time()
+        for content in stored:
+            codec.decompress(content)
+        decompress_time=time.time()-start
+        results.append((method,raw,sum(len(content) for content in stored),
+                        raw/1e6/max(compress_time,1e-9),raw/1e6/max(decompress_time,1e-9)))
+    return results
+
+if __name__=='__main__':
+    dbfile=sys.argv[1] if len(sys.argv)>1 else 'reportdiff_ps.db'
+    sample_size=int(sys.argv[2]) if len(sys.argv)>2 else 4000
+    codec=get_codec(dbfile)
+    rows=execute_sql(dbfile,"select content from report_text order by random() limit ?",(sample_size,))
+    texts=[codec.decompress(row["content"]) for row in rows or []]
+    texts=[text for text in texts if text]
+    if len(texts)<2:
+        print("Not enough reports in {0}".format(dbfile))
+        sys.exit(1)
+    print("Dictionary trained on {0} reports, measured on {1}".format(len(texts)//2,len(texts)-len(texts)//2))
+    print("{0:<16} {1:>12} {2:>12} {3:>7} {4:>12} {5:>12}".format("method","raw bytes","stored","ratio","comp MB/s","decomp MB/s"))
+    for (method,raw,stored,compress_rate,decompress_rate) in benchmark(texts):
+        print("{0:<16} {1:>12} {2:>12} {3:>7.2f} {4:>12.1f} {5:>12.1f}".format(method,raw,stored,float(raw)/stored,compress_rate,decompress_rate))
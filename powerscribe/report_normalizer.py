@@ -0,0 +1,112 @@
+"""ReportDiff report normalizer
+
+Normalizes report text before it is diffed, so that formatting changes are
+not scored as edits.  Hyphens (and punctuation, if enabled) are mapped to
+spaces by one precompiled translation table, and the text is then split on
+whitespace and joined once.  Case folding, punctuation removal and
+boilerplate stripping can be switched on.  Results are cached by report content, since
+the same report is normalized by the retriever, by rescoring and by each view
+of its diff.
+
+The retriever, the rescoring jobs and the viewer all normalize through
+get_normalizer(), so changing the settings below changes the scores of
+reports scored afterwards.  Stored diff deltas are relative to the
+normalized prelim, so studies must be rescored after a change for
+report_store.get_diff to decode their deltas.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+import string
+
+# Normalizer settings, used by get_normalizer()
+# Treat hyphens as spaces
+hyphens=True
+# Fold upper case to lower case
+case_fold=False
+# Treat punctuation as spaces
+punctuation=False
+# Regular expressions of boilerplate text, such as signature lines, removed
+# before normalizing
+boilerplate=[]
+# Number of normalized texts kept in each cache (one for normalize, one for
+# normalize_lines)
+cache_size=512
+
+class report_normalizer:
+    """Normalizes report text with a translation table and a cache
+
+    normalize(text) gives text with single spaces between words.
+    normalize_lines(text) also keeps one line break between non-blank lines;
+    replacing its line breaks with spaces gives normalize(text).
+    """
+
+    def __init__(self,hyphens=True,case_fold=False,punctuation=False,boilerplate=(),cache_size=512):
+        self.case_fold=case_fold
+        self.boilerplate=[re.compile(pattern,re.MULTILINE) for pattern in boilerplate]
+        self.cache_size=cache_size
+        self.cache={}
+        self.lines_cache={}
+        # Characters treated as spaces.  Whitespace needs no mapping, since
+        # split() and splitlines() already break on every kind of it.
+        self.spaces=u''
+        if hyphens:
+            self.spaces+=u'-'
+        if punctuation:
+            self.spaces+=u''.join(c for c in string.punctuation if c!='-')
+        self.table=dict((ord(c),u' ') for c in self.spaces)
+
+    def prepare(self,text):
+        """Strip boilerplate, then map the characters treated as spaces and fold case"""
+        for pattern in self.boilerplate:
+            text=pattern.sub(u'',text)
+        if len(self.spaces)==1:
+            # str.replace is faster than translate for a single character
+            text=text.replace(self.spaces,u' ')
+        elif self.spaces:
+            text=text.translate(self.table)
+        if self.case_fold:
+            text=text.lower()
+        return text
+
+    def normalize(self,text):
+        """Return text with hyphens and whitespace collapsed to single spaces"""
+        result=self.cache.get(text)
+        if result is None:
+            result=u' '.join(self.prepare(text).split())
+            if len(self.cache)>=self.cache_size:
+                self.cache.clear()
+            self.cache[text]=result
+        return result
+
+    def normalize_lines(self,text):
+        """Return normalize(text), but with one line break between non-blank lines"""
+        result=self.lines_cache.get(text)
+        if result is None:
+            result=u'\n'.join(filter(None,(u' '.join(line.split()) for line in self.prepare(text).splitlines())))
+            if len(self.lines_cache)>=self.cache_size:
+                self.lines_cache.clear()
+            self.lines_cache[text]=result
+        return result
+
+normalizer=None
+
+def get_normalizer():
+    """Return the normalizer built from the settings of this module"""
+    global normalizer
+    if normalizer is None:
+        normalizer=report_normalizer(hyphens,case_fold,punctuation,boilerplate,cache_size)
+    return normalizer
@@ -0,0 +1,129 @@
+"""ReportDiff report sections
+
+Splits reports into their headed sections (EXAM, CLINICAL HISTORY, TECHNIQUE,
+FINDINGS, IMPRESSION, ...) and aligns the sections of a prelim with those of
+its final, so that each pair of sections can be diffed on its own and scored
+separately.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+from report_store import normalize_report,normalize_lines
+import diff_engine
+
+# A section starts at a line that begins with an upper case heading and a colon
+header_re=re.compile(r'^[ \t]*([A-Z][A-Z0-9 /&,\-]*[A-Z0-9]):',re.MULTILINE)
+
+def split_sections(text,lines=False):
+    """Split a report into its sections
+
+    Text before the first heading is a section with the name "".  Joining the
+    section texts with spaces gives normalize_report(text).
+
+    Args:
+        text: report text
+        lines: normalize the sections with normalize_lines instead of
+            normalize_report, keeping their line breaks
+
+    Returns:
+        list of (name, normalized text) tuples
+    """
+    normalize=normalize_lines if lines else normalize_report
+    starts=[(m.start(),normalize_report(m.group(1))) for m in header_re.finditer(text)]
+    if not starts or starts[0][0]>0:
+        starts.insert(0,(0,""))
+    sections=[]
+    for (i,(start,name)) in enumerate(starts):
+        end=starts[i+1][0] if i+1<len(starts) else len(text)
+        section_text=normalize(text[start:end])
+        if section_text:
+            sections.append((name,section_text))
+    return sections
+
+def section_text(sections,separator=' '):
+    """Return the normalized text of a list of sections"""
+    return separator.join(text for (name,text) in sections)
+
+def align_sections(sections1,sections2,separator=' '):
+    """Align the sections of two reports by their names
+
+    Sections with the same name are paired in order.  A section that only
+    one report has is diffed together with the paired sections before it,
+    since a heading added or removed by the attending splits or joins the
+    text around it.
+
+    Args:
+        sections1: sections of the old report, from split_sections
+        sections2: sections of the new report
+        separator: separator of the sections in the texts, as for section_text
+
+    Returns:
+        Two element tuple.  The first element is the list of (text1, text2)
+        pieces, which concatenate to the normalized texts of the two reports.
+        The second is the list of (name, start1, end1, start2, end2) ranges of
+        each section in the normalized texts; a section that only one report
+        has has an empty range in the other.
+    """
+    # Each section's text in the joined report, with the separator that follows it
+    texts1=[text+separator for (name,text) in sections1]
+    texts2=[text+separator for (name,text) in sections2]
+    if texts1:
+        texts1[-1]=texts1[-1][:-1]
+    if texts2:
+        texts2[-1]=texts2[-1][:-1]
+
+    dmp=diff_engine.diff_engine()
+    dmp.Diff_Timeout=0
+    names={}
+    chars1=u''.join(diff_engine.unichr(names.setdefault(name,len(names)+1)) for (name,text) in sections1)
+    chars2=u''.join(diff_engine.unichr(names.setdefault(name,len(names)+1)) for (name,text) in sections2)
+
+    pieces=[]
+    ranges=[]
+    piece1=[]
+    piece2=[]
+    paired=False
+    i1=0
+    i2=0
+    pos1=0
+    pos2=0
+    for (op,data) in dmp.diff_main(chars1,chars2,False):
+        for j in range(len(data)):
+            if op==dmp.DIFF_EQUAL and paired:
+                pieces.append((''.join(piece1),''.join(piece2)))
+                piece1=[]
+                piece2=[]
+            if op==dmp.DIFF_INSERT:
+                text1=''
+            else:
+                text1=texts1[i1]
+                name=sections1[i1][0]
+                i1+=1
+            if op==dmp.DIFF_DELETE:
+                text2=''
+            else:
+                text2=texts2[i2]
+                name=sections2[i2][0]
+                i2+=1
+            ranges.append((name,pos1,pos1+len(text1),pos2,pos2+len(text2)))
+            piece1.append(text1)
+            piece2.append(text2)
+            pos1+=len(text1)
+            pos2+=len(text2)
+            paired=paired or op==dmp.DIFF_EQUAL
+    if piece1 or piece2:
+        pieces.append((''.join(piece1),''.join(piece2)))
+    return (pieces,ranges)
@@ -0,0 +1,164 @@
+"""ReportDiff report text storage
+
+Report bodies are kept in the report_text table, keyed by accession and
+version ("prelim" or "final"), apart from the study metadata that the analysis
+scripts and the viewer scan.  With ps_reportdiff.incremental_diff, when a
+scored study is re-dictated, its scored versions are kept as
+"prelim_previous" and "final_previous" until it is scored again.  The prelim and final columns of study are only
+kept so that older databases can be migrated; they are no longer filled.
+
+When compress_reports is set, bodies are stored compressed (see report_codec)
+and decompressed when they are read.
+
+The retriever stores each scored study's cleaned-up diff in study.diff_delta,
+so get_diff and get_diff_html rebuild the edits for display without diffing.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+from sqlite_db import connect,execute_sql,iter_sql_chunks
+import report_codec
+import report_normalizer
+import diff_engine
+
+# Compress report bodies when they are written
+compress_reports=True
+# A compression dictionary is trained once this many reports are stored
+dictionary_min_reports=500
+dictionary_sample_size=5000
+
+def create_report_table(dbfile):
+    """Create the report_text table and move any report text still stored in study"""
+    conn=connect(dbfile)
+    c=conn.cursor()
+    create_sql="""create table if not exists report_text(
+                    accession text,
+                    version text,
+                    content text,
+                    primary key(accession,version) );"""
+    c.execute(create_sql)
+    c.execute("""insert or ignore into report_text (accession,version,content)
+                    select accession,'prelim',prelim from study where prelim is not null""")
+    c.execute("""insert or ignore into report_text (accession,version,content)
+                    select accession,'final',final from study where final is not null""")
+    c.execute("""update study set prelim=null, final=null where prelim is not null or final is not null""")
+    moved=c.rowcount
+    c.close()
+    conn.commit()
+    if moved>0:
+        print("Moved report text of {0} studies to report_text".format(moved))
+        conn.execute("vacuum")
+    report_codec.create_dictionary_table(dbfile)
+    if compress_reports:
+        compress_stored_reports(dbfile)
+
+def train_dictionary(dbfile):
+    """Train a compression dictionary if there is none yet and enough reports are stored
+    
+    Called at startup and on every retrieval cycle, so a new database gets its
+    dictionary once it has dictionary_min_reports reports.
+    """
+    codec=report_codec.get_codec(dbfile)
+    if codec.dictionary_id==0 and report_codec.dictionary_supported and compress_reports:
+        count=execute_sql(dbfile,"select count(*) from report_text")[0][0]
+        if count>=dictionary_min_reports:
+            rows=execute_sql(dbfile,"select content from report_text order by random() limit ?",(dictionary_sample_size,))
+            report_codec.add_dictionary(dbfile,report_codec.train_dictionary(codec.decompress(row["content"]) for row in rows))
+
+def compress_stored_reports(dbfile):
+    """Train a compression dictionary if there is none yet, and compress any uncompressed report text"""
+    train_dictionary(dbfile)
+    codec=report_codec.get_codec(dbfile)
+    conn=connect(dbfile)
+    compressed=0
+    for chunk in iter_sql_chunks(dbfile,"select rowid, content from report_text where typeof(content)='text'",key="rowid",chunk_size=1000):
+        conn.executemany("update report_text set content=? where rowid=?",[(codec.compress(row["content"]),row["rowid"]) for row in chunk])
+        conn.commit()
+        compressed+=len(chunk)
+    if compressed>0:
+        print("Compressed {0} stored reports".format(compressed))
+
+def decode_report(dbfile,content):
+    """Return the text of report content as stored in report_text"""
+    return report_codec.get_codec(dbfile).decompress(content)
+
+def put_report(writer,accession,version,content):
+    """Queue a report body write on a sqlite_db.batch_writer"""
+    if compress_reports:
+        content=report_codec.get_codec(writer.dbfile).compress(content)
+    writer.add("""replace into report_text (accession,version,content) values (?,?,?)""",(accession,version,content))
+
+def delete_reports(writer,accession):
+    """Queue deletion of all report bodies of a study on a sqlite_db.batch_writer"""
+    writer.add("""delete from report_text where accession=?""",(accession,))
+
+def keep_previous_reports(writer,accession):
+    """Queue copying the prelim and final bodies of a study to the versions
+    "prelim_previous" and "final_previous" on a sqlite_db.batch_writer"""
+    writer.add("""replace into report_text (accession,version,content)
+                    select accession,version||'_previous',content from report_text
+                    where accession=? and version in ('prelim','final')""",(accession,))
+
+def delete_previous_reports(writer,accession):
+    """Queue deletion of the previous report bodies of a study on a sqlite_db.batch_writer"""
+    writer.add("""delete from report_text where accession=? and version in ('prelim_previous','final_previous')""",(accession,))
+
+def get_report(dbfile,accession,version):
+    """Return the text of one version of a report, or None if it is not stored"""
+    rows=execute_sql(dbfile,"""select content from report_text where accession=? and version=?""",(accession,version))
+    if not rows:
+        return None
+    return decode_report(dbfile,rows[0]["content"])
+
+def normalize_report(text):
+    """Collapse hyphens and whitespace so that formatting changes are not scored as edits (see report_normalizer)"""
+    return report_normalizer.get_normalizer().normalize(text)
+
+def normalize_lines(text):
+    """normalize_report, but keeping one line break between non-blank lines.
+    Replacing the line breaks with spaces gives normalize_report(text)."""
+    return report_normalizer.get_normalizer().normalize_lines(text)
+
+def get_diff(dbfile,accession):
+    """Return the scored diff of a study as an array of diff tuples from its
+    normalized prelim to its normalized final, or None if it has no stored diff
+    that matches its prelim"""
+    rows=execute_sql(dbfile,"""select diff_delta from study where accession=?""",(accession,))
+    if not rows or rows[0]["diff_delta"] is None:
+        return None
+    prelim=get_report(dbfile,accession,"prelim")
+    if prelim is None:
+        return None
+    try:
+        return diff_engine.diff_engine().diff_fromDelta(normalize_report(prelim),rows[0]["diff_delta"])
+    except ValueError:
+        # Scored with different normalizer settings; rescore the study to rebuild its diff
+        return None
+
+def get_diff_html(dbfile,accession):
+    """Return the scored diff of a study as HTML (diff_prettyHtml), or None if it has no stored diff"""
+    diffs=get_diff(dbfile,accession)
+    if diffs is None:
+        return None
+    return diff_engine.diff_engine().diff_prettyHtml(diffs)
+
+# Select columns for the stored prelim and final content of each study row;
+# pass the values through decode_report to get the text
+report_columns="""(select content from report_text where report_text.accession=study.accession and version='prelim') as prelim,
+                  (select content from report_text where report_text.accession=study.accession and version='final') as final"""
+# Select columns for the previous versions kept by keep_previous_reports
+previous_report_columns="""(select content from report_text where report_text.accession=study.accession and version='prelim_previous') as prelim_previous,
+                  (select content from report_text where report_text.accession=study.accession and version='final_previous') as final_previous"""
@@ -0,0 +1,232 @@
+"""ReportDiff report templates
+
+Indexes the lines that recur across many reports, such as the text of
+PowerScribe AutoText macros.  A template line that a prelim and its final
+both contain once is diffed as a fixed equality, so the diff only has to
+search the text between template blocks, and each report's share of
+template text is stored as study.template_percent.
+
+The index is built from a sample of stored reports once enough are stored
+(the retriever checks on every cycle), and can be rebuilt with
+
+    python report_templates.py [database] [sample size]
+
+Template lines are normalized with report_store.normalize_lines, so the index
+should be rebuilt after a change to the normalizer settings.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import bisect
+import collections
+import os,sys
+from sqlite_db import connect,execute_sql
+import report_store
+from report_store import normalize_lines
+
+# A line is a template line if at least this fraction of the sampled reports
+# contain it, and it is at least template_min_length characters long
+template_min_share=0.01
+template_min_length=20
+# The index is built once this many reports are stored, from a random sample
+index_min_reports=500
+index_sample_size=5000
+
+def create_template_table(dbfile):
+    """Create the template_line table, and build the index if it is empty"""
+    conn=connect(dbfile)
+    conn.execute("""create table if not exists template_line(
+                    line text,
+                    reports int,
+                    primary key(line) );""")
+    conn.commit()
+    if execute_sql(dbfile,"select count(*) from template_line")[0][0]==0:
+        update_template_index(dbfile)
+
+def find_template_lines(texts,min_share=template_min_share,min_length=template_min_length):
+    """Find the normalized lines that recur across reports
+
+    Args:
+        texts: list of report texts
+        min_share: minimum fraction of the texts that contain a template line
+        min_length: minimum length of a template line
+
+    Returns:
+        list of (line, number of texts containing it)
+    """
+    counts=collections.Counter()
+    for text in texts:
+        counts.update(set(normalize_lines(text).split('\n')))
+    min_reports=max(2,min_share*len(texts))
+    return [(line,count) for (line,count) in counts.items() if count>=min_reports and len(line)>=min_length]
+
+def update_template_index(dbfile,sample_size=index_sample_size,rebuild=False):
+    """Build the template index from a sample of the stored reports
+
+    Does nothing if fewer than index_min_reports reports are stored, or if the
+    index is already built and rebuild is False.
+
+    Returns:
+        number of template lines in the index
+    """
+    count=execute_sql(dbfile,"select count(*) from template_line")[0][0]
+    if count>0 and not rebuild:
+        return count
+    if execute_sql(dbfile,"select count(*) from report_text")[0][0]<index_min_reports:
+        return 0
+    rows=execute_sql(dbfile,"""select content from report_text where version in ('prelim','final')
+                                order by random() limit ?""",(sample_size,))
+    texts=[report_store.decode_report(dbfile,row["content"]) for row in rows or []]
+    lines=find_template_lines([text for text in texts if text])
+    conn=connect(dbfile)
+    conn.execute("delete from template_line")
+    conn.executemany("insert into template_line (line,reports) values (?,?)",lines)
+    conn.commit()
+    indexes.pop((os.getpid(),dbfile),None)
+    print("Indexed {0} template lines from {1} reports".format(len(lines),len(texts)))
+    return len(lines)
+
+class template_index():
+    """Set of template lines
+
+    Args:
+        lines: iterable of normalized template lines
+    """
+
+    def __init__(self,lines=()):
+        self.lines=frozenset(lines)
+
+    def common_lines(self,text1,text2):
+        """Return the template lines that two line-normalized texts both contain"""
+        if not self.lines:
+            return frozenset()
+        return self.lines.intersection(text1.split('\n')).intersection(text2.split('\n'))
+
+    def template_percent(self,text):
+        """Return the percentage of the characters of a line-normalized text that are in template lines"""
+        if not text:
+            return None
+        templated=sum(len(line) for line in text.split('\n') if line in self.lines)
+        return templated*100.0/len(text)
+
+indexes={}
+
+def get_template_index(dbfile):
+    """Return this process's template index of a database"""
+    key=(os.getpid(),dbfile)
+    index=indexes.get(key)
+    if index is None:
+        rows=execute_sql(dbfile,"select line from template_line")
+        index=template_index(row["line"] for row in rows or [])
+        indexes[key]=index
+    return index
+
+def anchor_pieces(pieces,anchors):
+    """Split diff pieces at the template lines they share
+
+    A template line in anchors that occurs once in each text of a piece is
+    split off as a piece of its own, so that diff_engine.diff_sections keeps
+    it as an equality; runs of such lines are kept together as one block.
+    If template lines were moved, the largest set of them that is in the same
+    order in both texts is anchored, as in a patience diff.
+
+    Args:
+        pieces: list of (text1, text2) pieces of line-normalized texts, as for
+            diff_engine.diff_sections
+        anchors: set of template lines, from template_index.common_lines
+
+    Returns:
+        list of (text1, text2) pieces that concatenate to the same texts
+    """
+    if not anchors:
+        return pieces
+    result=[]
+    for (text1,text2) in pieces:
+        if text1==text2:
+            result.append((text1,text2))
+            continue
+        lines1=text1.split('\n')
+        lines2=text2.split('\n')
+        counts1=collections.Counter(line for line in lines1 if line in anchors)
+        counts2=collections.Counter(line for line in lines2 if line in anchors)
+        positions2=dict((line,j) for (j,line) in enumerate(lines2) if counts2[line]==1)
+        matches=[(i,positions2[line]) for (i,line) in enumerate(lines1) if counts1[line]==1 and line in positions2]
+        # [start, end) line ranges of the anchored blocks in each text
+        blocks=[]
+        for (i,j) in increasing_matches(matches):
+            if blocks and blocks[-1][1]==i and blocks[-1][3]==j:
+                blocks[-1][1]=i+1
+                blocks[-1][3]=j+1
+            else:
+                blocks.append([i,i+1,j,j+1])
+        if not blocks:
+            result.append((text1,text2))
+            continue
+        starts1=line_starts(lines1)
+        starts2=line_starts(lines2)
+        pos1=0
+        pos2=0
+        for (i0,i1,j0,j1) in blocks:
+            (start1,end1)=(starts1[i0],starts1[i1]-1)
+            (start2,end2)=(starts2[j0],starts2[j1]-1)
+            if start1>pos1 or start2>pos2:
+                result.append((text1[pos1:start1],text2[pos2:start2]))
+            result.append((text1[start1:end1],text2[start2:end2]))
+            (pos1,pos2)=(end1,end2)
+        if pos1<len(text1) or pos2<len(text2):
+            result.append((text1[pos1:],text2[pos2:]))
+    return result
+
+def increasing_matches(matches):
+    """Return the longest subsequence of (i, j) line matches, sorted by i, whose j also increases"""
+    # tails[k] is the index of the match ending the best run of length k+1 found so far
+    tails=[]
+    tail_positions=[]
+    previous=[]
+    for (n,(i,j)) in enumerate(matches):
+        k=bisect.bisect_left(tail_positions,j)
+        previous.append(tails[k-1] if k>0 else None)
+        if k==len(tails):
+            tails.append(n)
+            tail_positions.append(j)
+        else:
+            tails[k]=n
+            tail_positions[k]=j
+    result=[]
+    n=tails[-1] if tails else None
+    while n is not None:
+        result.append(matches[n])
+        n=previous[n]
+    result.reverse()
+    return result
+
+def line_starts(lines):
+    """Return the offset of each line in the text joined from lines, followed by len(text)+1"""
+    starts=[0]
+    for line in lines:
+        starts.append(starts[-1]+len(line)+1)
+    return starts
+
+if __name__=='__main__':
+    dbfile=sys.argv[1] if len(sys.argv)>1 else 'reportdiff_ps.db'
+    sample_size=int(sys.argv[2]) if len(sys.argv)>2 else index_sample_size
+    create_template_table(dbfile)
+    if update_template_index(dbfile,sample_size,rebuild=True)==0:
+        print("Not enough reports in {0}".format(dbfile))
+        sys.exit(1)
+    rows=execute_sql(dbfile,"select line, reports from template_line order by reports*length(line) desc limit 20")
+    for row in rows:
+        print("{0:>6} {1}".format(row["reports"],row["line"]))
@@ -0,0 +1,151 @@
+"""ReportDiff batch rescoring
+
+Recomputes the character edit distance of every scored study in a database
+(study.edit_distance and edit_distance_percent), for instance after a change
+to the normalizer settings:
+
+    python rescore.py [database] [processes] [all]
+
+Without "all", only studies that have no edit distance yet are scored,
+which is every study unless the retriever ran with
+ps_reportdiff.edit_distance_scores on.  The edit distance is stored for
+reference and is not used by the other scores;
+to recompute diff_score and the other diff-based scores instead, run
+
+    python rescore.py [database] [processes] diffs
+
+which clears them and scores every study with a final again with
+ps_reportdiff.get_diffs.  Pairs whose normalized text and scoring settings
+are unchanged are taken from the diff cache.
+
+The distances are computed with diff_engine.diff_editDistance, which works
+on whole columns of the edit distance matrix at once as bit vectors, or
+searches a band around the main diagonal when the study's diff_score shows
+the distance is small, so no diff is built.  Stored reports are decoded and
+normalized in the worker processes, and the results are written back in
+large batches.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import multiprocessing
+import sys,time
+from sqlite_db import execute_sql,add_columns,iter_sql_chunks,batch_writer
+import report_store
+from report_store import normalize_report
+import diff_engine
+import ps_reportdiff
+
+# Rows read at a time, and rows written per transaction
+chunk_size=2000
+write_batch_rows=5000
+write_batch_delay=10.0
+
+edit_distance_columns=[("edit_distance","int"),("edit_distance_percent","real")]
+
+def edit_distance(item):
+    """Compute the edit distance of one study
+
+    Runs in the worker processes, so it only depends on its argument.
+
+    Args:
+        item: (dbfile, accession, stored prelim, stored final, diff_score)
+            tuple, with the report content as stored in report_text
+
+    Returns:
+        (accession, edit_distance, edit_distance_percent) tuple, or None if
+        either report is missing or the final is blank
+    """
+    (dbfile,accession,prelim,final,diff_score)=item
+    prelim=report_store.decode_report(dbfile,prelim)
+    final=report_store.decode_report(dbfile,final)
+    if prelim is None or final is None:
+        return None
+    prelim=normalize_report(prelim)
+    final=normalize_report(final)
+    if not final:
+        return None
+    # The Levenshtein distance of the scored diff is at most diff_score, so
+    # it bounds the banded search unless the normalization has changed
+    distance=diff_engine.diff_engine().diff_editDistance(prelim,final,diff_score)
+    return (accession,distance,distance*100.0/len(final))
+
+def rescore(dbfile,processes=1,rescore_all=False):
+    """Compute the edit distances of the scored studies of a database
+
+    Args:
+        dbfile: SQLite database file
+        processes: number of worker processes (1 scores in this process)
+        rescore_all: rescore studies that already have an edit distance
+
+    Returns:
+        number of studies scored
+    """
+    add_columns(dbfile,"study",edit_distance_columns)
+    query="select accession, diff_score, "+report_store.report_columns+" from study where final_timestamp is not null"
+    if not rescore_all:
+        query+=" and edit_distance is null"
+    pool=multiprocessing.Pool(processes) if processes>1 else None
+    writer=batch_writer(dbfile,write_batch_rows,write_batch_delay)
+    scored=0
+    start=time.time()
+    try:
+        for chunk in iter_sql_chunks(dbfile,query,chunk_size=chunk_size):
+            items=[(dbfile,row["accession"],row["prelim"],row["final"],row["diff_score"]) for row in chunk]
+            if pool is not None:
+                results=pool.imap_unordered(edit_distance,items,chunksize=max(1,len(items)//(processes*4)))
+            else:
+                results=(edit_distance(item) for item in items)
+            for result in results:
+                if result is None:
+                    continue
+                (accession,distance,percent)=result
+                writer.add("update study set edit_distance=?, edit_distance_percent=? where accession=?",(distance,percent,accession))
+                writer.commit_point()
+                scored+=1
+            print("{0} studies scored, {1:.0f}/s".format(scored,scored/max(time.time()-start,1e-9)))
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return scored
+
+def rescore_diffs(dbfile,processes=1):
+    """Recompute the diff scores of every study with a final report
+
+    Args:
+        dbfile: SQLite database file
+        processes: number of worker processes (1 scores in this process)
+
+    Returns:
+        number of studies scored
+    """
+    ps_reportdiff.create_sqlite_table(dbfile)
+    # get_diffs scores the studies with no diff_score, so an interrupted run is finished by the next
+    # retriever cycle
+    execute_sql(dbfile,"update study set diff_score=null where final_timestamp is not null")
+    ps_reportdiff.get_diffs(dbfile,processes)
+    return execute_sql(dbfile,"select count(*) from study where diff_score is not null")[0][0]
+
+if __name__=='__main__':
+    dbfile=sys.argv[1] if len(sys.argv)>1 else 'reportdiff_ps.db'
+    processes=int(sys.argv[2]) if len(sys.argv)>2 else multiprocessing.cpu_count()
+    mode=sys.argv[3] if len(sys.argv)>3 else None
+    if mode=="diffs":
+        rescore_diffs(dbfile,processes)
+    else:
+        rescore(dbfile,processes,mode=="all")
@@ -0,0 +1,217 @@
+"""SQLite storage helpers shared by the ReportDiff scripts
+
+Each thread of each process keeps one long-lived connection per database
+file, since a sqlite3 connection can only be used by the thread that opened
+it (the Flask viewer serves requests on several threads).  Databases are
+switched to write-ahead logging, so the Flask viewer and the analysis scripts
+can read while the retriever writes.
+
+Copyright 2015-2016 Phillip Cheng, MD MS
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from __future__ import print_function
+import sqlite3
+import os,time
+import threading
+
+# Seconds to wait for another connection's write lock before giving up
+busy_timeout=30
+# Page cache size per connection in KiB
+cache_size=16384
+
+# Connections of each thread, keyed by process id and file, so that a forked
+# child does not use its parent's connection
+local=threading.local()
+
+def thread_connections():
+    if not hasattr(local,"connections"):
+        local.connections={}
+    return local.connections
+
+def connect(dbfile):
+    """Return this thread's connection to a SQLite file, opening it on first use
+    
+    Args:
+        dbfile: SQLite database file
+    
+    Returns:
+        sqlite3.Connection with sqlite3.Row rows
+    """
+    connections=thread_connections()
+    key=(os.getpid(),dbfile)
+    conn=connections.get(key)
+    if conn is None:
+        conn=sqlite3.connect(dbfile,timeout=busy_timeout)
+        conn.row_factory=sqlite3.Row
+        conn.execute("pragma journal_mode=WAL")
+        conn.execute("pragma synchronous=NORMAL")
+        conn.execute("pragma cache_size=-{0}".format(cache_size))
+        connections[key]=conn
+    return conn
+
+def close(dbfile):
+    """Close this thread's connection to a SQLite file, if open"""
+    conn=thread_connections().pop((os.getpid(),dbfile),None)
+    if conn is not None:
+        conn.close()
+
+def execute_sql(dbfile,query,params=None):
+    """Execute SQL against a SQLite file
+    
+    Args:
+        dbfile: SQLite database file
+        query: SQL query
+        params: sequence of parameters
+    
+    Returns:
+        list of matching rows
+    """
+    conn=connect(dbfile)
+    c=conn.cursor()
+    
+    try:
+        if params is None:
+            c.execute(query)
+        else:
+            c.execute(query,params)
+        res=c.fetchall()
+    except sqlite3.OperationalError as e:
+        print(e)
+        res=None
+    c.close()
+    conn.commit()
+    return res
+
+def add_columns(dbfile,table,columns):
+    """Add the columns a table is missing, for databases created by older versions
+    
+    Args:
+        dbfile: SQLite database file
+        table: table name
+        columns: sequence of (name, type) pairs
+    """
+    existing=set(row["name"] for row in execute_sql(dbfile,"pragma table_info({0})".format(table)))
+    for (name,column_type) in columns:
+        if name not in existing:
+            execute_sql(dbfile,"alter table {0} add column {1} {2}".format(table,name,column_type))
+
+def iter_sql_chunks(dbfile,query,params=(),key="accession",chunk_size=100):
+    """Run a select in chunks of rows, ordered by a unique key column
+    
+    Each chunk re-runs the query for keys after the last row of the previous
+    chunk, so only one chunk is held in memory and no cursor stays open while
+    the caller writes through the same connection.
+    
+    Args:
+        dbfile: SQLite database file
+        query: select statement with a where clause (parenthesized if it uses or)
+            and no order by or limit
+        params: sequence of parameters
+        key: unique column selected by the query
+        chunk_size: maximum number of rows per chunk
+    
+    Yields:
+        lists of matching rows
+    """
+    params=tuple(params)
+    last=None
+    while True:
+        if last is None:
+            rows=execute_sql(dbfile,query+" order by "+key+" limit ?",params+(chunk_size,))
+        else:
+            rows=execute_sql(dbfile,query+" and "+key+">? order by "+key+" limit ?",params+(last,chunk_size))
+        if not rows:
+            return
+        yield rows
+        last=rows[-1][key]
+
+class batch_writer():
+    """Collects row writes and flushes them with executemany in one transaction
+    
+    The writes of one logical unit, such as everything stored for one study,
+    are ended with commit_point().  Complete units are flushed when max_rows
+    writes are pending or max_delay seconds have passed since the oldest one,
+    and when the writer is closed.  Each flush commits or rolls back as a
+    whole and never splits a unit, so after a crash a study is either fully
+    written or not at all, and a restart only repeats work.  Writes after the
+    last commit point are dropped by close() and discard().
+    
+    Use as a context manager, or call close() when done:
+    
+        with batch_writer(dbfile) as writer:
+            writer.add("update study set diff_score=? where accession=?",(score,accession))
+            writer.add("delete from section_score where accession=?",(accession,))
+            writer.commit_point()
+    """
+    
+    def __init__(self,dbfile,max_rows=100,max_delay=1.0):
+        self.dbfile=dbfile
+        self.max_rows=max_rows
+        self.max_delay=max_delay
+        self.pending=[]
+        # Number of pending writes that belong to complete units
+        self.complete=0
+        self.first_pending=None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+    
+    def add(self,query,params):
+        """Queue one write of the current unit"""
+        if not self.pending:
+            self.first_pending=time.time()
+        self.pending.append((query,params))
+    
+    def commit_point(self):
+        """End the current unit, flushing if the batch is full or old enough"""
+        self.complete=len(self.pending)
+        if self.pending and (len(self.pending)>=self.max_rows or time.time()-self.first_pending>=self.max_delay):
+            self.flush()
+    
+    def discard(self):
+        """Drop the writes of the current unit, such as after an error part way through it"""
+        del self.pending[self.complete:]
+    
+    def flush(self):
+        """Write the pending rows of complete units in one transaction, keeping their order"""
+        if not self.complete:
+            return
+        pending=self.pending[:self.complete]
+        del self.pending[:self.complete]
+        self.complete=0
+        if self.pending:
+            self.first_pending=time.time()
+        conn=connect(self.dbfile)
+        try:
+            start=0
+            while start<len(pending):
+                query=pending[start][0]
+                end=start+1
+                while end<len(pending) and pending[end][0]==query:
+                    end+=1
+                conn.executemany(query,[params for (q,params) in pending[start:end]])
+                start=end
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
+    
+    def close(self):
+        """Flush the complete units and drop the writes of an unfinished one"""
+        self.flush()
+        self.pending=[]
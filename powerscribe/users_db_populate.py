@@ -19,41 +19,11 @@ limitations under the License.
 """
 
 from __future__ import print_function
-import sqlite3
 import base64,powerscribe
+from sqlite_db import execute_sql
 import xml.etree.ElementTree as ET
 import os
 
-def execute_sql(dbfile,query,params=None):
-    """Execute SQL against a SQLite file
-    
-    Args:
-        dbfile: SQLite database file
-        query: SQL query
-        params: sequence of parameters
-    
-    Returns:
-        list of matching rows
-    """
-    conn=sqlite3.connect(dbfile)
-    conn.row_factory=sqlite3.Row
-    c=conn.cursor()
-    
-    try:
-        if params is None:
-            c.execute(query)
-        else:
-            c.execute(query,params)
-        res=c.fetchall()
-    except sqlite3.OperationalError as e:
-        print(e)
-        res=None
-    c.close()
-    conn.commit()
-    conn.close()
-    return res
-
-    
 if __name__=='__main__':    
     dbfile='users.db'    
     execute_sql(dbfile,'''CREATE TABLE if not exists users